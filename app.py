@@ -1,14 +1,52 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session, flash
+from flask import Flask, Response, g, has_request_context, render_template, request, jsonify, send_file, send_from_directory, redirect, url_for, session, flash
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo import MongoClient
-from bson import ObjectId
+from pymongo import MongoClient, ASCENDING, ReturnDocument, UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import Decimal128, ObjectId, json_util
 from dotenv import load_dotenv, find_dotenv
 from datetime import datetime
-from datetime import timedelta
+from datetime import date, timedelta, timezone
 
 import os
+import click
+import functools
+import gzip
+import hashlib
+import hmac
+import queue
+import random
+import threading
+import time
+try:
+    import brotli
+except ImportError:  # optional: responses fall back to gzip
+    brotli = None
+try:
+    import orjson
+except ImportError:  # optional: the standard json module is used instead
+    orjson = None
+from decimal import Decimal
 from io import BytesIO
+import mimetypes
+import gridfs
 import requests
+from PIL import Image
+from markupsafe import Markup
+from werkzeug.security import safe_join
+
+from assets import BUNDLES, DIST_DIR, build_assets, load_manifest
+from lifecycle import (
+    apply_transition, describe_failure, on_transition, parse_version, transition_guard, transition_update
+)
+from memwatch import MemoryTracker
+from profiler import StackSampler
+from webhook_log import WebhookLogWriter, sanitize_webhook_body
+from writebehind import WriteBehindBuffer
+from scheduling import (
+    DEFAULT_DAY_CONFIG, DEFAULT_DURATION, DayIntervals, compile_day_template, expand_blocks,
+    free_slot_starts, from_minutes, to_minutes
+)
 
 # -----------------------------
 # TIME FORMAT HELPER
@@ -45,16 +83,131 @@ load_dotenv(dotenv_path=env_path, override=True)
 # Messenger tokens (ADDED)
 PAGE_ACCESS_TOKEN = os.getenv("PAGE_ACCESS_TOKEN")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
+# Overridable so load tests and benchmarks can point the bot at a local stand-in
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v17.0").rstrip("/")
 print("PAGE_ACCESS_TOKEN loaded:", bool(PAGE_ACCESS_TOKEN))
 
 
+# -----------------------------
+# JSON (Mongo documents serialize as-is)
+# -----------------------------
+class MongoJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider for jsonify() and the tojson filter that understands BSON
+    types: ObjectId -> str, datetime/date -> ISO 8601, Decimal/Decimal128 -> str.
+    Documents can be returned straight from a cursor without converting _id.
+    Uses orjson when it is installed.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal128):
+            return str(o.to_decimal())
+        if isinstance(o, Decimal):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_option(self, sort_keys):
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        # orjson has no equivalent for options such as indent; leave those to json
+        if orjson is None or set(kwargs) - {"sort_keys"}:
+            return super().dumps(obj, **kwargs)
+        option = self._orjson_option(kwargs.get("sort_keys", self.sort_keys))
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or (self.compact is None and self._app.debug):
+            # Pretty-printed in debug mode, as Flask does by default
+            return super().response(obj)
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_option(self.sort_keys))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
 # Flask setup
 app = Flask(__name__)
+# Set before the Jinja environment is created so tojson uses it as well
+app.json = MongoJSONProvider(app)
 # Register filter
 app.jinja_env.filters['to_ampm'] = to_ampm
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev_secret")
 
 
+# -----------------------------
+# STATIC ASSETS (fingerprinted build, see assets.py)
+# -----------------------------
+# After `flask build-assets`, templates load bundled, hashed files from /dist/.
+# Their names change whenever their content does, so browsers may keep them
+# for a year without asking again. Without a build the plain static files are used.
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSET_MANIFEST = load_manifest(app.static_folder)
+
+
+def asset_url_for(endpoint, **values):
+    """url_for for templates: static files resolve to their fingerprinted copy."""
+    if endpoint == "static":
+        built = ASSET_MANIFEST["files"].get(values.get("filename"))
+        if built:
+            return url_for("dist_asset", filename=built)
+    return url_for(endpoint, **values)
+
+
+def asset_tags(bundle):
+    """<link>/<script> tags for a bundle, or for its sources if not built."""
+    built = ASSET_MANIFEST["bundles"].get(bundle)
+    if built:
+        urls = [url_for("dist_asset", filename=built)]
+    else:
+        urls = [url_for("static", filename=source) for source in BUNDLES[bundle]]
+
+    if bundle.endswith(".css"):
+        tags = [f'<link rel="stylesheet" href="{url}">' for url in urls]
+    else:
+        tags = [f'<script src="{url}"></script>' for url in urls]
+    return Markup("\n    ".join(tags))
+
+
+app.jinja_env.globals.update(url_for=asset_url_for, asset_tags=asset_tags)
+
+
+@app.route("/dist/<path:filename>")
+def dist_asset(filename):
+    dist_folder = os.path.join(app.static_folder, DIST_DIR)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    # Serve the precompressed sibling written by the build when the browser takes it
+    served, encoding = filename, None
+    for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+        path = safe_join(dist_folder, filename + suffix)
+        if request.accept_encodings[candidate] and path and os.path.isfile(path):
+            served, encoding = filename + suffix, candidate
+            break
+
+    response = send_from_directory(dist_folder, served, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Bundle, fingerprint and precompress static assets into static/dist."""
+    manifest = build_assets(app.static_folder)
+    ASSET_MANIFEST.update(manifest)
+    print(f"✅ Built {len(manifest['bundles'])} bundles and {len(manifest['files'])} files")
+
+
 # MongoDB setup
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
@@ -66,6 +219,7 @@ db = client[DB_NAME]
 
 users_collection = db["users"]
 appointments_collection = db["appointments"]
+appointments_archive_collection = db["appointments_archive"]
 services_collection = db["services"]
 payments_collection = db["payments"]
 messages_collection = db["messages"]
@@ -74,40 +228,982 @@ messenger_users_collection = db["messenger_users"]
 schedules_collection = db["schedules"]
 calendar_collection = db["calendar"]
 blocked_collection = db["blocked_slots"]
+changes_collection = db["changes"]
+profiles_collection = db["profiles"]
+counters_collection = db["counters"]
+proofs_fs = gridfs.GridFS(db, collection="payment_proofs")
 
 print("Connected to:", DB_NAME)
 
+# Change-log entries are kept this long; older tabs just reload in full
+CHANGE_LOG_TTL_SECONDS = 7 * 24 * 60 * 60
+# Stored request profiles (see REQUEST PROFILER) expire after this long
+PROFILE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# -----------------------------
+# INDEXES
+# -----------------------------
+def ensure_indexes():
+    """Create the indexes the hot queries rely on (no-op if they already exist)."""
+    # Pending-payments review queue: filter + keyset sort, and index-only counts
+    appointments_collection.create_index(
+        [("payment_status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]
+    )
+    # Per-day availability lookups
+    appointments_collection.create_index([("date", ASCENDING), ("status", ASCENDING)])
+    blocked_collection.create_index([("date", ASCENDING)])
+    blocked_collection.create_index([("recurrence.from", ASCENDING)], sparse=True)
+    # Archival sweep and archive lookups by date range
+    appointments_collection.create_index([("status", ASCENDING), ("date", ASCENDING)])
+    appointments_archive_collection.create_index([("date", ASCENDING)])
+    # Change feed: read by sequence, expired by age
+    changes_collection.create_index([("seq", ASCENDING)], unique=True)
+    changes_collection.create_index([("kind", ASCENDING), ("seq", ASCENDING)])
+    changes_collection.create_index("ts", expireAfterSeconds=CHANGE_LOG_TTL_SECONDS)
+    # Request profiles: listed newest first per route, kept for a week
+    profiles_collection.create_index([("route", ASCENDING), ("created_at", ASCENDING)])
+    profiles_collection.create_index("created_at", expireAfterSeconds=PROFILE_TTL_SECONDS)
+    # Inbox: threads by recent activity, and each thread's messages in order
+    conversations_collection.create_index([("last_at", ASCENDING), ("_id", ASCENDING)])
+    messages_collection.create_index([("sender_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)])
+    # Messenger redelivers webhooks it thinks failed; each inbound message is stored once
+    messages_collection.create_index("mid", unique=True, partialFilterExpression={"mid": {"$type": "string"}})
+
+try:
+    ensure_indexes()
+except Exception as e:
+    print(f"⚠️ Could not create indexes: {e}")
+
+# -----------------------------
+# BACKGROUND WORKERS
+# -----------------------------
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def submit_background(work_queue, handler, item):
+    """Put an item on a queue, starting the daemon thread that drains it on first use."""
+    with _workers_lock:
+        worker = _workers.get(id(work_queue))
+        if worker is None or not worker.is_alive():
+            worker = threading.Thread(
+                target=_drain_queue, args=(work_queue, handler), daemon=True
+            )
+            worker.start()
+            _workers[id(work_queue)] = worker
+    work_queue.put(item)
+
+
+def _drain_queue(work_queue, handler):
+    while True:
+        item = work_queue.get()
+        try:
+            handler(item)
+        except Exception as e:
+            print(f"Background task {handler.__name__} failed for {item!r}: {e}")
+        finally:
+            work_queue.task_done()
+
+# -----------------------------
+# CHANGE FEED
+# -----------------------------
+# Every appointment, payment and block mutation appends {seq, kind, entity_id, op}
+# to changes_collection (TTL-expired). Admin pages remember the last seq they saw
+# and ask for ?since=<seq> to fetch only what changed.
+CHANGE_FEED_MAX_ENTRIES = 1000
+# record_changes reserves seqs before inserting their entries, so a reader can
+# see entry N while N-1 is still on its way. Readers stop in front of such a gap
+# until the entries after it are this old; by then N-1's writer has failed.
+CHANGE_GAP_GRACE_SECONDS = 10
+
+# Signalled whenever this process records a change (see live_event_stream)
+_change_condition = threading.Condition()
+
+
+def next_sequence(name, count=1, extra_inc=None):
+    """Reserve `count` consecutive numbers from a named counter; returns the last one."""
+    counter = counters_collection.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"seq": count, **(extra_inc or {})}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+
+def get_data_versions():
+    """
+    Per-kind version counters ({"appointment": n, "block": m, ...}). They live
+    on the same counter document as the change sequence, so bumping one costs
+    nothing extra when a change is recorded. Read once per request.
+    """
+    if has_request_context() and "data_versions" in g:
+        return g.data_versions
+    counter = counters_collection.find_one({"_id": "changes"}, {"v": 1})
+    versions = (counter or {}).get("v", {})
+    if has_request_context():
+        g.data_versions = versions
+    return versions
+
+
+def bump_data_versions(*kinds):
+    """Invalidate cached output for kinds changed without change-log entries (migrations)."""
+    counters_collection.update_one(
+        {"_id": "changes"},
+        {"$inc": {f"v.{kind}": 1 for kind in kinds}},
+        upsert=True
+    )
+
+
+def current_sequence(name):
+    counter = counters_collection.find_one({"_id": name})
+    # Version bumps and the unread total can create the document before any change
+    return (counter or {}).get("seq", 0)
+
+
+def record_changes(kind, entity_ids, op="update"):
+    """Append one change-log entry per entity. Never fails the calling request."""
+    ids = [str(i) for i in entity_ids]
+    if not ids:
+        return
+    try:
+        last = next_sequence("changes", len(ids), {f"v.{kind}": 1})
+        now = datetime.now(timezone.utc)
+        changes_collection.insert_many([
+            {"seq": last - len(ids) + 1 + i, "kind": kind, "entity_id": entity_id, "op": op, "ts": now}
+            for i, entity_id in enumerate(ids)
+        ], ordered=False)
+    except Exception as e:
+        print(f"Error recording {kind} changes: {e}")
+        return
+
+    # Wake this worker's live streams right away
+    with _change_condition:
+        _change_condition.notify_all()
+
+
+@on_transition
+def _record_transition(action, appt):
+    kind = "payment" if action in ("approve_payment", "decline_payment") else "appointment"
+    record_changes(kind, [appt["_id"]], action)
+
+
+def changes_since(kinds, since):
+    """
+    Entries of the given kinds after `since`.
+    Returns (entries, next cursor, reset); reset=True means the log no longer
+    reaches back to `since` and the caller should reload everything. The
+    cursor only moves past seqs that are in the log (or given up on, see
+    CHANGE_GAP_GRACE_SECONDS), so an entry that is inserted late is not skipped.
+    """
+    latest = current_sequence("changes")
+    if since >= latest:
+        return [], latest, since > latest
+
+    oldest = changes_collection.find_one({}, {"seq": 1}, sort=[("seq", ASCENDING)])
+    if not oldest or since < oldest["seq"] - 1:
+        return [], latest, True
+
+    # All kinds are read: gaps can only be seen in the full sequence
+    logged = list(changes_collection.find(
+        {"seq": {"$gt": since, "$lte": latest}},
+        {"_id": 0, "seq": 1, "kind": 1, "entity_id": 1, "op": 1, "ts": 1}
+    ).sort("seq", ASCENDING).limit(CHANGE_FEED_MAX_ENTRIES + 1))
+
+    if len(logged) > CHANGE_FEED_MAX_ENTRIES:
+        return [], latest, True
+
+    gap_cutoff = datetime.now(timezone.utc) - timedelta(seconds=CHANGE_GAP_GRACE_SECONDS)
+    cursor = since
+    entries = []
+    for entry in logged:
+        ts = entry.pop("ts")
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        if entry["seq"] != cursor + 1 and ts > gap_cutoff:
+            # An earlier reservation may still be inserting its entry
+            break
+        cursor = entry["seq"]
+        if entry["kind"] in kinds:
+            entries.append(entry)
+    return entries, cursor, False
+
+
+def parse_since():
+    """The ?since=<seq> argument as an int, or None for a full load."""
+    try:
+        return int(request.args["since"])
+    except (KeyError, ValueError):
+        return None
+
+
+# -----------------------------
+# LIVE ADMIN EVENTS (Server-Sent Events)
+# -----------------------------
+# Streams read the change log. Changes made in this worker wake them up
+# immediately through _change_condition; changes made by other workers are
+# picked up by polling the log every LIVE_POLL_SECONDS.
+LIVE_POLL_SECONDS = 5
+# Each open stream holds a worker for up to LIVE_STREAM_MAX_SECONDS, which would
+# starve sync gunicorn workers (and the Messenger webhook). Only switch this on
+# with async or threaded workers, e.g. `gunicorn -k gevent app:app` or
+# `gunicorn --threads 32 app:app`; otherwise pages poll /api/changes instead.
+LIVE_STREAMING = os.getenv("LIVE_STREAMING", "0") == "1"
+app.jinja_env.globals["live_streaming"] = LIVE_STREAMING
+LIVE_HEARTBEAT_SECONDS = 25
+# Streams end after this long and the browser's EventSource reconnects
+# (resuming from Last-Event-ID), so a worker thread is never held forever
+LIVE_STREAM_MAX_SECONDS = 300
+
+LIVE_SUMMARY_PROJECTION = {
+    "fullname": 1, "service": 1, "date": 1, "time": 1, "status": 1,
+    "payment_status": 1, "payment_method": 1, "downpayment": 1, "payment_proof": 1,
+    "claimed_by_name": 1, "version": 1
+}
+
+
+def live_event_payloads(entries):
+    """Attach a small summary of each appointment to its change entries."""
+    ids = []
+    for e in entries:
+        if e["kind"] in ("appointment", "payment"):
+            try:
+                ids.append(ObjectId(e["entity_id"]))
+            except Exception:
+                pass
+    summaries = {
+        str(a["_id"]): a
+        for a in appointments_collection.find({"_id": {"$in": ids}}, LIVE_SUMMARY_PROJECTION)
+    } if ids else {}
+
+    payloads = []
+    for e in entries:
+        payload = dict(e)
+        appt = summaries.get(e["entity_id"])
+        if appt:
+            payload["appointment"] = {
+                "id": str(appt["_id"]),
+                "fullname": appt.get("fullname"),
+                "service": appt.get("service"),
+                "date": appt.get("date"),
+                "time": to_ampm(appt.get("time", "")),
+                "status": appt.get("status"),
+                "payment_status": appt.get("payment_status"),
+                "payment_method": appt.get("payment_method"),
+                "downpayment": appt.get("downpayment", 0),
+                "has_proof": bool(appt.get("payment_proof")),
+                "claimed_by_name": appt.get("claimed_by_name"),
+                "version": appt.get("version", 0)
+            }
+        payloads.append(payload)
+    return payloads
+
+
+def live_event_stream(since, kinds):
+    started = datetime.now()
+    last_sent = datetime.now()
+    # Tell the browser how soon to reconnect once the stream ends
+    yield "retry: 3000\n\n"
+
+    while (datetime.now() - started).total_seconds() < LIVE_STREAM_MAX_SECONDS:
+        entries, latest, reset = changes_since(kinds, since)
+        if reset:
+            yield f"id: {latest}\nevent: reset\ndata: {{}}\n\n"
+        elif entries:
+            for payload in live_event_payloads(entries):
+                yield f"id: {payload['seq']}\nevent: change\ndata: {app.json.dumps(payload)}\n\n"
+            last_sent = datetime.now()
+        elif (datetime.now() - last_sent).total_seconds() >= LIVE_HEARTBEAT_SECONDS:
+            # Comment line keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            last_sent = datetime.now()
+        since = latest
+
+        with _change_condition:
+            _change_condition.wait(timeout=LIVE_POLL_SECONDS)
+
+
+@app.route("/api/events/stream")
+def live_events():
+    """
+    Server-Sent Events for admin pages: new bookings, payment proofs,
+    approvals/declines and cancellations as they happen.
+    ?kinds=appointment,payment,block narrows the stream.
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    if not LIVE_STREAMING:
+        return jsonify({"success": False, "error": "Live streaming is disabled; poll /api/changes"}), 404
+
+    # Resume after a reconnect, otherwise start from "now"
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args["since"])
+    except (KeyError, ValueError):
+        since = current_sequence("changes")
+
+    kinds = request.args.get("kinds", "appointment,payment").split(",")
+    return Response(
+        live_event_stream(since, kinds),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/api/changes")
+def api_changes():
+    """
+    Change log: ?since=<seq>&kinds=appointment,payment,block. Entries carry
+    the same appointment summaries as the live stream, so pages can poll
+    this when streaming is off.
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    since = parse_since()
+    if since is None:
+        return jsonify({"success": True, "seq": current_sequence("changes"), "changes": [], "reset": True})
+
+    kinds = request.args.get("kinds", "appointment,payment,block").split(",")
+    entries, latest, reset = changes_since(kinds, since)
+    return jsonify({"success": True, "seq": latest, "changes": live_event_payloads(entries), "reset": reset})
+
+# -----------------------------
+# OUTPUT CACHE (rendered admin pages and JSON feeds)
+# -----------------------------
+# Responses are cached per route + query string + day, tagged with the data
+# kinds they depend on. Any recorded change to one of those kinds bumps its
+# version counter, which makes the entry stale in every worker. While one
+# request re-renders a stale entry, concurrent requests get the stale copy
+# (for at most PAGE_CACHE_MAX_STALE_SECONDS) instead of rendering it again.
+PAGE_CACHE_MAX_ENTRIES = 256
+PAGE_CACHE_MAX_STALE_SECONDS = 30
+PAGE_CACHE_HEADERS = ("X-Change-Seq",)
+# Renders of the same key are serialized on one of a fixed set of locks
+PAGE_CACHE_LOCK_STRIPES = 64
+
+_page_cache = {}
+_page_cache_locks = [threading.Lock() for _ in range(PAGE_CACHE_LOCK_STRIPES)]
+_page_cache_guard = threading.Lock()
+
+
+def _cached_response(entry, state):
+    body = entry["body"]
+    encoding = negotiate_encoding(len(body), entry["mimetype"])
+    if encoding:
+        # Compress each cached entry once per encoding, not on every hit
+        encoded = entry.setdefault("encoded", {})
+        if encoding not in encoded:
+            encoded[encoding] = compress_body(body, encoding)
+        body = encoded[encoding]
+
+    response = app.response_class(body, status=200, mimetype=entry["mimetype"])
+    for name, value in entry["headers"].items():
+        response.headers[name] = value
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+    response.headers["X-Cache"] = state
+    return response
+
+
+def _render_and_store(key, versions, view, args, kwargs):
+    response = app.make_response(view(*args, **kwargs))
+    if response.status_code == 200 and not response.is_streamed:
+        entry = {
+            "versions": versions,
+            "body": response.get_data(),
+            "mimetype": response.mimetype,
+            "headers": {h: response.headers[h] for h in PAGE_CACHE_HEADERS if h in response.headers},
+            "stored_at": datetime.now()
+        }
+        with _page_cache_guard:
+            if key not in _page_cache and len(_page_cache) >= PAGE_CACHE_MAX_ENTRIES:
+                _page_cache.pop(next(iter(_page_cache)))
+            _page_cache[key] = entry
+    response.headers["X-Cache"] = "MISS"
+    return response
+
+
+def cached_view(*kinds, public=False):
+    """
+    Cache a GET view's output until data of one of `kinds` changes.
+    Unless public=True, only logged-in requests are served from the cache;
+    everyone else gets the view's own redirect or error.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or (not public and "user_id" not in session):
+                return view(*args, **kwargs)
+
+            # Admin pages can show who is logged in, so keep them per user
+            key = (request.endpoint, request.full_path, date.today().isoformat(),
+                   None if public else session["user_id"])
+            all_versions = get_data_versions()
+            versions = tuple(all_versions.get(kind, 0) for kind in kinds)
+
+            entry = _page_cache.get(key)
+            if entry and entry["versions"] == versions:
+                return _cached_response(entry, "HIT")
+
+            lock = _page_cache_locks[hash(key) % PAGE_CACHE_LOCK_STRIPES]
+
+            if entry and (datetime.now() - entry["stored_at"]).total_seconds() <= PAGE_CACHE_MAX_STALE_SECONDS:
+                # Stale-while-revalidate: only one request renders, the rest reuse the old copy
+                if not lock.acquire(blocking=False):
+                    return _cached_response(entry, "STALE")
+                try:
+                    return _render_and_store(key, versions, view, args, kwargs)
+                finally:
+                    lock.release()
+
+            with lock:
+                # Another request may have rendered it while we waited
+                entry = _page_cache.get(key)
+                if entry and entry["versions"] == versions:
+                    return _cached_response(entry, "HIT")
+                return _render_and_store(key, versions, view, args, kwargs)
+
+        return wrapper
+    return decorator
+
+
+# -----------------------------
+# CONDITIONAL GET AND COMPRESSION
+# -----------------------------
+# JSON feeds get an ETag built from the version counters of the data they read,
+# so a client re-fetching unchanged data gets a 304 without the view running.
+# Text responses above COMPRESS_MIN_BYTES are sent brotli- or gzip-encoded.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/css", "text/javascript", "application/javascript"}
+
+
+def conditional_get(*kinds):
+    """Answer If-None-Match with 304 while data of `kinds` is unchanged."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+
+            versions = get_data_versions()
+            # The day is part of the tag: feeds default to windows around today
+            fingerprint = "|".join([
+                request.full_path,
+                date.today().isoformat(),
+                *(f"{kind}={versions.get(kind, 0)}" for kind in kinds)
+            ])
+            etag = hashlib.sha1(fingerprint.encode()).hexdigest()[:20]
+
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                # A stale cached copy must not be tagged as the current version
+                if response.status_code != 200 or response.headers.get("X-Cache") == "STALE":
+                    return response
+            response.set_etag(etag, weak=True)
+            # Always revalidate; a matching tag costs one counter read
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def negotiate_encoding(size, mimetype):
+    """Best content encoding the client accepts for a body, or None."""
+    if size < COMPRESS_MIN_BYTES or mimetype not in COMPRESS_MIMETYPES:
+        return None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers):
+        return response
+
+    encoding = negotiate_encoding(response.calculate_content_length() or 0, response.mimetype)
+    if encoding:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+# -----------------------------
+# REQUEST PROFILER (opt-in, admin-only)
+# -----------------------------
+# A logged-in admin can profile one request by sending "X-Profile: 1", and
+# PROFILE_SAMPLE_RATE (0-1) profiles that fraction of all requests. The
+# stack samples (see profiler.py) are stored per route in profiles_collection
+# and listed at /api/profiles; /api/profiles/<id>/folded is flamegraph input.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+profile_queue = queue.Queue()
+
+
+@app.before_request
+def start_profiler():
+    requested = request.headers.get("X-Profile") == "1" and session.get("role") == "admin"
+    if requested or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        g.profiler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS).start()
+
+
+@app.after_request
+def stop_profiler(response):
+    sampler = g.pop("profiler", None)
+    if sampler is None:
+        return response
+
+    sampler.stop()
+    profile_id = ObjectId()
+    submit_background(profile_queue, profiles_collection.insert_one, {
+        "_id": profile_id,
+        "route": request.url_rule.rule if request.url_rule else request.path,
+        "endpoint": request.endpoint,
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "status": response.status_code,
+        "duration_ms": round(sampler.elapsed_ms, 2),
+        "interval_ms": PROFILE_INTERVAL_MS,
+        "samples": sampler.samples,
+        # Dotted stack strings are stored as a list; they are not valid field names
+        "stacks": [[stack, count] for stack, count in sampler.stacks.most_common()],
+        "created_at": datetime.now()
+    })
+    response.headers["X-Profile-Id"] = str(profile_id)
+    return response
+
+
+def admin_only():
+    """Error response for JSON admin endpoints, or None if the user is an admin."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    if session.get("role") != "admin":
+        return jsonify({"success": False, "error": "Admins only"}), 403
+    return None
+
+
+@app.route("/api/profiles")
+def list_profiles():
+    """Recent profiles, newest first. Filter with ?route=/reports; ?limit= up to 200."""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    query = {"route": request.args["route"]} if request.args.get("route") else {}
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 200))
+    except ValueError:
+        limit = 50
+
+    profiles = list(profiles_collection.find(query, {"stacks": 0}).sort("created_at", -1).limit(limit))
+    return jsonify({"success": True, "profiles": profiles})
+
+
+def find_profile(profile_id):
+    try:
+        return profiles_collection.find_one({"_id": ObjectId(profile_id)})
+    except Exception:
+        return None
+
+
+@app.route("/api/profiles/<profile_id>")
+def get_profile(profile_id):
+    denied = admin_only()
+    if denied:
+        return denied
+
+    profile = find_profile(profile_id)
+    if not profile:
+        return jsonify({"success": False, "error": "Profile not found"}), 404
+    return jsonify({"success": True, "profile": profile})
+
+
+@app.route("/api/profiles/<profile_id>/folded")
+def get_profile_folded(profile_id):
+    """Collapsed stacks ("a;b;c 12" per line) for flamegraph.pl or speedscope."""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    profile = find_profile(profile_id)
+    if not profile:
+        return jsonify({"success": False, "error": "Profile not found"}), 404
+    body = "\n".join(f"{stack} {count}" for stack, count in profile["stacks"]) + "\n"
+    return Response(body, mimetype="text/plain")
+
+
+# -----------------------------
+# CLINIC HOURS (compiled slot templates)
+# -----------------------------
+# Weekly hours live in schedules_collection as {"type": "weekly", "weekday": 0-6, ...}
+# and holiday/one-off overrides as {"type": "exception", "date": "YYYY-MM-DD", ...}.
+# They are compiled once into slot lists and reused until an edit invalidates them.
+# Other workers see the edit's "schedule" version bump on their next request;
+# SCHEDULE_CACHE_TTL only covers edits made outside the app.
+SCHEDULE_CACHE_TTL = timedelta(seconds=60)
+SCHEDULE_FIELDS = ("open", "close", "breaks", "slot_minutes", "closed")
+
+_schedule_cache = {"loaded_at": None, "version": None, "weekly": {}, "exceptions": {}}
+_schedule_cache_lock = threading.Lock()
+
+
+def invalidate_schedule_cache():
+    with _schedule_cache_lock:
+        _schedule_cache["loaded_at"] = None
+
+
+def _load_schedule_templates():
+    weekly = {day: compile_day_template(DEFAULT_DAY_CONFIG) for day in range(7)}
+    exceptions = {}
+    for entry in schedules_collection.find({"type": {"$in": ["weekly", "exception"]}}):
+        if entry["type"] == "weekly":
+            weekly[entry["weekday"]] = compile_day_template(entry)
+        else:
+            exceptions[entry["date"]] = compile_day_template(entry)
+    return weekly, exceptions
+
+
+def get_slot_template(date):
+    """Compiled (slot start, window end) list for a 'YYYY-MM-DD' date."""
+    now = datetime.now()
+    # Read before the templates, so a concurrent edit leaves them tagged as outdated
+    version = get_data_versions().get("schedule", 0)
+    with _schedule_cache_lock:
+        loaded_at = _schedule_cache["loaded_at"]
+        if (loaded_at is None or now - loaded_at > SCHEDULE_CACHE_TTL
+                or _schedule_cache["version"] != version):
+            weekly, exceptions = _load_schedule_templates()
+            _schedule_cache.update(loaded_at=now, version=version, weekly=weekly, exceptions=exceptions)
+        weekly = _schedule_cache["weekly"]
+        exceptions = _schedule_cache["exceptions"]
+
+    if date in exceptions:
+        return exceptions[date]
+    return weekly[datetime.strptime(date, "%Y-%m-%d").weekday()]
+
+
+def parse_schedule_entry(data):
+    """Validate opening-hours fields from a request; raises ValueError."""
+    entry = {field: data[field] for field in SCHEDULE_FIELDS if field in data}
+    entry["closed"] = bool(entry.get("closed", False))
+    if entry["closed"]:
+        return entry
+
+    entry.setdefault("breaks", [])
+    entry["slot_minutes"] = int(entry.get("slot_minutes") or 60)
+    if not 5 <= entry["slot_minutes"] <= 240:
+        raise ValueError("slot_minutes must be between 5 and 240")
+    if "open" not in entry or "close" not in entry:
+        raise ValueError("open and close are required")
+    if to_minutes(entry["open"]) >= to_minutes(entry["close"]):
+        raise ValueError("open must be before close")
+    for br in entry["breaks"]:
+        if to_minutes(br["start"]) >= to_minutes(br["end"]):
+            raise ValueError("each break must start before it ends")
+    return entry
+
+
+@app.route("/api/schedules")
+def get_schedules():
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    weekly = {day: dict(DEFAULT_DAY_CONFIG, weekday=day) for day in range(7)}
+    exceptions = []
+    for entry in schedules_collection.find({"type": {"$in": ["weekly", "exception"]}}, {"_id": 0}):
+        if entry["type"] == "weekly":
+            weekly[entry["weekday"]] = entry
+        else:
+            exceptions.append(entry)
+
+    exceptions.sort(key=lambda e: e["date"])
+    return jsonify({"success": True, "weekly": [weekly[d] for d in range(7)], "exceptions": exceptions})
+
+
+@app.route("/api/schedules/weekly", methods=["POST"])
+def update_weekly_schedule():
+    """Set the opening hours for one weekday (0 = Monday)."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    data = request.get_json() or {}
+    try:
+        weekday = int(data["weekday"])
+        if not 0 <= weekday <= 6:
+            raise ValueError("weekday must be 0-6")
+        entry = parse_schedule_entry(data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": f"Invalid schedule: {e}"}), 400
+
+    schedules_collection.replace_one(
+        {"type": "weekly", "weekday": weekday},
+        {"type": "weekly", "weekday": weekday, **entry, "updated_at": datetime.now()},
+        upsert=True
+    )
+    invalidate_schedule_cache()
+    record_changes("schedule", [f"weekly-{weekday}"], "update")
+    return jsonify({"success": True})
+
+
+@app.route("/api/schedules/exception", methods=["POST"])
+def upsert_schedule_exception():
+    """Override the hours for a single date, e.g. a holiday ({"closed": true})."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    data = request.get_json() or {}
+    try:
+        date_str = data["date"]
+        datetime.strptime(date_str, "%Y-%m-%d")
+        entry = parse_schedule_entry(data)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": f"Invalid exception: {e}"}), 400
+
+    schedules_collection.replace_one(
+        {"type": "exception", "date": date_str},
+        {
+            "type": "exception",
+            "date": date_str,
+            **entry,
+            "reason": data.get("reason", "Holiday"),
+            "updated_at": datetime.now()
+        },
+        upsert=True
+    )
+    invalidate_schedule_cache()
+    record_changes("schedule", [date_str], "update")
+    return jsonify({"success": True})
+
+
+@app.route("/api/schedules/exception/<date>", methods=["DELETE"])
+def delete_schedule_exception(date):
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    result = schedules_collection.delete_one({"type": "exception", "date": date})
+    invalidate_schedule_cache()
+    record_changes("schedule", [date], "delete")
+    return jsonify({"success": result.deleted_count > 0})
+
+
+# -----------------------------
+# BLOCKED SLOTS (one-off and recurring)
+# -----------------------------
+# Expanded occurrences are cached per requested date range and cleared whenever
+# a block is added or removed. Entries are tagged with the "block" data version,
+# so other workers refresh as soon as they see it move; BLOCK_CACHE_TTL only
+# covers edits made outside the app.
+BLOCK_CACHE_TTL = timedelta(seconds=30)
+BLOCK_CACHE_MAX_RANGES = 64
+BLOCK_FEED_MAX_DAYS = 92
+
+_block_cache = {}
+_block_cache_lock = threading.Lock()
+
+
+def invalidate_block_cache():
+    with _block_cache_lock:
+        _block_cache.clear()
+
+
+def get_block_occurrences(first, last):
+    """
+    Concrete blocked intervals between two 'YYYY-MM-DD' dates (inclusive):
+    {'YYYY-MM-DD': [(start_minutes, end_minutes, block), ...]}
+    """
+    key = (first, last)
+    now = datetime.now()
+    # Read before the blocks, so a concurrent change leaves them tagged as outdated
+    version = get_data_versions().get("block", 0)
+    with _block_cache_lock:
+        cached = _block_cache.get(key)
+        if cached and cached[1] == version and now - cached[0] <= BLOCK_CACHE_TTL:
+            return cached[2]
+
+    blocks = list(blocked_collection.find({"$or": [
+        {"date": {"$gte": first, "$lte": last}},
+        {
+            "recurrence.from": {"$lte": last},
+            "$or": [{"recurrence.until": None}, {"recurrence.until": {"$gte": first}}]
+        }
+    ]}))
+    occurrences = expand_blocks(
+        blocks,
+        datetime.strptime(first, "%Y-%m-%d").date(),
+        datetime.strptime(last, "%Y-%m-%d").date()
+    )
+
+    with _block_cache_lock:
+        if len(_block_cache) >= BLOCK_CACHE_MAX_RANGES:
+            _block_cache.pop(next(iter(_block_cache)))
+        _block_cache[key] = (now, version, occurrences)
+    return occurrences
+
+
+def remove_block(event_id, scope="occurrence"):
+    """
+    Remove a blocked slot. Calendar ids of the form '<block id>_<YYYY-MM-DD>'
+    are single occurrences of a recurring block: with scope="occurrence" only
+    that date is skipped, with scope="series" the whole block is deleted.
+    """
+    block_id, _, day = str(event_id).partition("_")
+    if not ObjectId.is_valid(block_id):
+        return False
+
+    if day and scope != "series":
+        result = blocked_collection.update_one(
+            {"_id": ObjectId(block_id), "recurrence": {"$exists": True}},
+            {"$addToSet": {"recurrence.except": day}}
+        )
+        removed, op = result.matched_count > 0, "update"
+    else:
+        removed, op = blocked_collection.delete_one({"_id": ObjectId(block_id)}).deleted_count > 0, "delete"
+
+    invalidate_block_cache()
+    if removed:
+        record_changes("block", [block_id], op)
+    return removed
+
+
 # -----------------------------
 # HELPER FUNCTION: GET FREE TIMES
 # -----------------------------
-def get_free_times_for_date(date):
+# Appointments in these states no longer occupy their slot
+RELEASED_STATUSES = ["cancelled", "declined"]
+
+
+def get_service_duration(service_id):
+    """Duration in minutes for a service id, falling back to the default."""
+    if not service_id:
+        return DEFAULT_DURATION
+    try:
+        service = services_collection.find_one({"_id": ObjectId(service_id)}, {"duration": 1})
+    except Exception:
+        return DEFAULT_DURATION
+    return int(service.get("duration") or DEFAULT_DURATION) if service else DEFAULT_DURATION
+
+
+def get_appointment_duration(appointment_id):
+    """Duration in minutes of an existing appointment's service."""
+    appt = appointments_collection.find_one(
+        {"_id": ObjectId(appointment_id)}, {"service": 1, "service_duration": 1}
+    )
+    if not appt:
+        return DEFAULT_DURATION
+    if appt.get("service_duration"):
+        return int(appt["service_duration"])
+    service = services_collection.find_one({"name": appt.get("service")}, {"duration": 1})
+    return int(service.get("duration") or DEFAULT_DURATION) if service else DEFAULT_DURATION
+
+
+def collect_busy_intervals(first, last, exclude_id=None):
+    """
+    Busy intervals (in minutes) per date between two 'YYYY-MM-DD' dates
+    (inclusive): every active appointment for its service's duration, plus
+    blocked slots to the minute. One appointments query covers the whole range.
+    """
+    query = {"date": {"$gte": first, "$lte": last}, "status": {"$nin": RELEASED_STATUSES}}
+    if exclude_id:
+        query["_id"] = {"$ne": ObjectId(exclude_id)}
+
+    booked = list(appointments_collection.find(
+        query, {"date": 1, "time": 1, "service": 1, "service_duration": 1}
+    ))
+
+    # Older bookings have no duration snapshot: resolve them in one query
+    missing = list({b.get("service") for b in booked if not b.get("service_duration")})
+    durations = {}
+    if missing:
+        durations = {
+            s["name"]: s.get("duration")
+            for s in services_collection.find({"name": {"$in": missing}}, {"name": 1, "duration": 1})
+        }
+
+    per_day = {}
+    for b in booked:
+        try:
+            start = to_minutes(to_24h(b["time"]))
+        except (KeyError, ValueError):
+            continue
+        duration = b.get("service_duration") or durations.get(b.get("service")) or DEFAULT_DURATION
+        per_day.setdefault(b["date"], []).append((start, start + int(duration)))
+
+    for day, occurrences in get_block_occurrences(first, last).items():
+        per_day.setdefault(day, []).extend((start, end) for start, end, _ in occurrences)
+
+    return per_day
+
+
+def get_busy_intervals(date, exclude_id=None):
+    """Merged busy intervals for a single date."""
+    return DayIntervals(collect_busy_intervals(date, date, exclude_id).get(date, []))
+
+
+def get_free_times_for_date(date, duration=None, exclude_id=None):
     """
     Return a list of available time slots in 12-hour AM/PM format for a given date.
     This is the internal function used by both the API endpoint and webhook.
+    A slot is only offered if a booking of `duration` minutes fits there.
     """
-    # All possible clinic times in 24-hour format
-    all_times_24h = ["09:00", "10:00", "11:00", "13:00", "14:00", "15:00", "16:00"]
-
-    # Get booked slots
-    booked = appointments_collection.find({"date": date})
-    booked_times = [b["time"] for b in booked]
+    slots = get_slot_template(date)
+    if not slots:
+        return []
 
-    # Get blocked slots
-    blocked = blocked_collection.find({"date": date})
-    blocked_times = []
-    for b in blocked:
-        start_hour = int(b["start"].split(":")[0])
-        end_hour = int(b["end"].split(":")[0])
-        for h in range(start_hour, end_hour):
-            blocked_times.append(f"{h:02d}:00")
+    busy = get_busy_intervals(date, exclude_id)
+    free = free_slot_starts(slots, busy, duration or DEFAULT_DURATION)
 
-    # Compute free times in 24-hour format
-    free_24h = [t for t in all_times_24h if t not in booked_times and t not in blocked_times]
-    
     # Convert to 12-hour AM/PM format for display
-    free_12h = [to_ampm(t) for t in free_24h]
+    return [to_ampm(from_minutes(m)) for m in free]
+
+
+def find_earliest_slots(duration=None, count=5, horizon_days=45, first_day=None):
+    """
+    The next `count` open (date, 'HH:MM') starts for a booking of `duration`
+    minutes, searching up to `horizon_days` days from `first_day` (tomorrow by
+    default). Appointments and blocks for the whole horizon are read once.
+    """
+    duration = duration or DEFAULT_DURATION
+    first_day = first_day or date.today() + timedelta(days=1)
+    last_day = first_day + timedelta(days=horizon_days - 1)
+    busy_by_day = collect_busy_intervals(
+        first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+    )
 
-    return free_12h
+    results = []
+    day = first_day
+    while day <= last_day and len(results) < count:
+        day_str = day.strftime("%Y-%m-%d")
+        slots = get_slot_template(day_str)
+        if slots:
+            busy = DayIntervals(busy_by_day.get(day_str, ()))
+            for start in free_slot_starts(slots, busy, duration)[:count - len(results)]:
+                results.append((day_str, from_minutes(start)))
+        day += timedelta(days=1)
+
+    return results
+
+
+def is_time_available(date, time_24h, duration=None, exclude_id=None):
+    """Check one specific start time just before it gets booked."""
+    start = to_minutes(time_24h)
+    duration = duration or DEFAULT_DURATION
+    if start not in free_slot_starts(get_slot_template(date), DayIntervals(), duration):
+        return False
+    return get_busy_intervals(date, exclude_id).is_free(start, start + duration)
 
 # -----------------------------
 # HOME PAGE
@@ -230,6 +1326,20 @@ def update_profile():
 
 
 
+# Fields each list page renders; everything else (proof URLs, decline reasons,
+# audit timestamps, ...) stays in the database
+DASHBOARD_APPOINTMENT_PROJECTION = {"fullname": 1, "date": 1, "time": 1, "service": 1, "status": 1}
+APPOINTMENT_LIST_PROJECTION = {
+    "fullname": 1, "date": 1, "time": 1, "service": 1, "status": 1,
+    "downpayment": 1, "payment_method": 1, "payment_status": 1, "version": 1
+}
+PAYMENT_LIST_PROJECTION = {
+    "fullname": 1, "service": 1, "downpayment": 1, "payment_method": 1, "payment_status": 1, "version": 1,
+    # Only whether a proof exists, not the proof URL itself
+    "has_proof": {"$ne": [{"$type": "$payment_proof"}, "missing"]}
+}
+
+
 @app.route("/")
 def index():
     # Redirect to login if not authenticated, otherwise to dashboard
@@ -238,6 +1348,7 @@ def index():
     return redirect(url_for("dashboard"))
 
 @app.route("/dashboard")
+@cached_view("appointment", "payment", "message")
 def dashboard():
     # Require authentication
     if "user_id" not in session:
@@ -260,32 +1371,30 @@ def dashboard():
     today_appointments = list(appointments_collection.find({
         "date": today_str,
         "status": {"$in": ["confirmed", "rescheduled"]}  # Include both statuses
-    }))
+    }, DASHBOARD_APPOINTMENT_PROJECTION))
     print(f"Today's appointments: {len(today_appointments)}")
 
     # Fetch upcoming confirmed and rescheduled appointments within next 7 days
     upcoming_appointments = list(appointments_collection.find({
         "date": {"$gt": today_str, "$lte": date_7days},
         "status": {"$in": ["confirmed", "rescheduled"]}  # Include both statuses
-    }).sort("date", 1))
+    }, DASHBOARD_APPOINTMENT_PROJECTION).sort("date", 1))
     
     print(f"Upcoming appointments: {len(upcoming_appointments)}")
     for appt in upcoming_appointments:
         print(f"  - {appt.get('fullname')} on {appt.get('date')} at {appt.get('time')} [{appt.get('status')}]")
     print(f"{'='*50}\n")
 
-    # Fetch cancelled appointments
-    cancelled_appointments = list(appointments_collection.find({
-        "status": "cancelled"
-    }))
-
-    # Fetch pending payments
-    pending_payments = list(appointments_collection.find({
+    # The dashboard only shows how many cancellations, pending payments and
+    # unread messages there are, so count them instead of loading them
+    cancelled_count = appointments_collection.count_documents({
+        "status": "cancelled",
+        "archived": {"$ne": True}
+    })
+    pending_payments_count = appointments_collection.count_documents({
         "payment_status": "pending"
-    }))
-
-    # Fetch unread messages
-    new_messages = list(messages_collection.find({"read": {"$ne": True}}))
+    })
+    new_messages_count = get_unread_total()
 
     # Convert appointment times to 12-hour format
     for appt in today_appointments + upcoming_appointments:
@@ -295,34 +1404,350 @@ def dashboard():
         "index.html",
         today_appointments=today_appointments,
         upcoming_appointments=upcoming_appointments,
-        cancelled_appointments=cancelled_appointments,
-        pending_payments=pending_payments,
-        new_messages=new_messages
+        cancelled_count=cancelled_count,
+        pending_payments_count=pending_payments_count,
+        new_messages_count=new_messages_count
+    )
+
+# -----------------------------
+# MESSENGER INBOX
+# -----------------------------
+# messages: {sender_id, direction: "in"|"out", text, timestamp, read, mid (inbound only)}
+# conversations (one per sender, _id = sender_id): the last message, the
+# message count and `unread`, kept up to date as messages are stored. The
+# total of all `unread` counters lives on the change-feed counter document
+# as "unread_messages", so the dashboard reads one document. Both lists are
+# keyset-paginated newest first; pass next_cursor back as ?before=.
+INBOX_PAGE_SIZE = 20
+INBOX_MAX_LIMIT = 100
+
+CONVERSATION_PROJECTION = {
+    "name": 1, "last_text": 1, "last_direction": 1, "last_at": 1, "unread": 1, "message_count": 1
+}
+
+
+def encode_inbox_cursor(doc, field):
+    return f"{doc[field].isoformat()}_{doc['_id']}"
+
+
+def decode_inbox_cursor(cursor):
+    at, _, doc_id = cursor.rpartition("_")
+    return datetime.fromisoformat(at), doc_id
+
+
+def keyset_before(field, cursor, id_type=str):
+    """Query part for documents strictly older than the cursor in (field, _id) order."""
+    at, doc_id = decode_inbox_cursor(cursor)
+    doc_id = id_type(doc_id)
+    return {"$or": [{field: {"$lt": at}}, {field: at, "_id": {"$lt": doc_id}}]}
+
+
+def inbox_limit():
+    try:
+        return max(1, min(int(request.args.get("limit", INBOX_PAGE_SIZE)), INBOX_MAX_LIMIT))
+    except ValueError:
+        return INBOX_PAGE_SIZE
+
+
+def get_unread_total():
+    counter = counters_collection.find_one({"_id": "changes"}, {"unread_messages": 1})
+    return max((counter or {}).get("unread_messages", 0), 0)
+
+
+def adjust_unread_total(delta, token=None):
+    """
+    Move the unread total and invalidate cached pages that show it, in one write.
+    With a token (see _store_transcript_batch) the adjustment is applied at most once.
+    """
+    query = {"_id": "changes"}
+    update = {"$inc": {"unread_messages": delta, "v.message": 1}}
+    if token is not None:
+        query["unread_batches"] = {"$ne": token}
+        update["$push"] = {"unread_batches": {"$each": [token], "$slice": -APPLIED_BATCHES_KEPT}}
+    try:
+        counters_collection.update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        # The document exists: it already holds the token, or another worker just created it
+        counters_collection.update_one(query, update)
+
+
+def list_conversations(before=None, limit=INBOX_PAGE_SIZE):
+    """(conversations, next_cursor), most recently active first."""
+    query = keyset_before("last_at", before) if before else {}
+    items = list(
+        conversations_collection.find(query, CONVERSATION_PROJECTION)
+        .sort([("last_at", -1), ("_id", -1)])
+        .limit(limit)
     )
+    next_cursor = encode_inbox_cursor(items[-1], "last_at") if len(items) == limit else None
+    return items, next_cursor
+
+
+def mark_conversation_read(sender_id):
+    """
+    Mark a conversation's messages read; returns how many were unread.
+    The counters go down by exactly the messages this call changed, so a
+    transcript batch whose messages are stored but not yet counted (see
+    _store_transcript_batch) evens out once its own increment lands.
+    """
+    cleared = messages_collection.update_many(
+        {"sender_id": sender_id, "direction": "in", "read": {"$ne": True}},
+        {"$set": {"read": True}}
+    ).modified_count
+    if cleared:
+        conversations_collection.update_one({"_id": sender_id}, {"$inc": {"unread": -cleared}})
+        adjust_unread_total(-cleared)
+    return cleared
+
 
 @app.route("/inbox")
 def inbox():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    
-    messages = list(messages_collection.find().sort("timestamp", -1))
-    return render_template("inbox.html", messages=messages)
+
+    conversations, next_cursor = list_conversations()
+    return render_template(
+        "inbox.html",
+        conversations=conversations,
+        next_cursor=next_cursor,
+        unread_total=get_unread_total()
+    )
+
+
+@app.route("/api/inbox/conversations")
+def inbox_conversations():
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    try:
+        conversations, next_cursor = list_conversations(request.args.get("before"), inbox_limit())
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+    return jsonify({"success": True, "conversations": conversations, "next_cursor": next_cursor})
+
+
+@app.route("/api/inbox/<sender_id>/messages")
+def inbox_messages(sender_id):
+    """One thread, newest first; the page reverses it for display."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    query = {"sender_id": sender_id}
+    before = request.args.get("before")
+    if before:
+        try:
+            query.update(keyset_before("timestamp", before, ObjectId))
+        except Exception:
+            return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
+    limit = inbox_limit()
+    messages = list(
+        messages_collection.find(query, {"sender_id": 0})
+        .sort([("timestamp", -1), ("_id", -1)])
+        .limit(limit)
+    )
+    next_cursor = encode_inbox_cursor(messages[-1], "timestamp") if len(messages) == limit else None
+    return jsonify({"success": True, "messages": messages, "next_cursor": next_cursor})
+
+
+@app.route("/api/inbox/<sender_id>/read", methods=["POST"])
+def inbox_mark_read(sender_id):
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    cleared = mark_conversation_read(sender_id)
+    return jsonify({"success": True, "cleared": cleared, "unread_total": get_unread_total()})
+
+
+@app.cli.command("rebuild-conversations")
+def rebuild_conversations_command():
+    """Recompute conversations and the unread total from the messages collection."""
+    messages_collection.aggregate([
+        {"$sort": {"sender_id": 1, "timestamp": 1, "_id": 1}},
+        {"$group": {
+            "_id": "$sender_id",
+            "last_text": {"$last": "$text"},
+            "last_direction": {"$last": "$direction"},
+            "last_at": {"$last": "$timestamp"},
+            "message_count": {"$sum": 1},
+            "unread": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$direction", "in"]}, {"$ne": ["$read", True]}]}, 1, 0
+            ]}}
+        }},
+        {"$merge": {"into": "conversations", "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ], allowDiskUse=True)
+
+    total = next(conversations_collection.aggregate([
+        {"$group": {"_id": None, "unread": {"$sum": "$unread"}}}
+    ]), {}).get("unread", 0)
+    counters_collection.update_one(
+        {"_id": "changes"},
+        {"$set": {"unread_messages": total}, "$inc": {"v.message": 1}},
+        upsert=True
+    )
+    print(f"✅ Rebuilt {conversations_collection.count_documents({})} conversations, {total} unread messages")
+
+
+# -----------------------------
+# MESSAGE TRANSCRIPTS (write-behind)
+# -----------------------------
+# Every message a sender sends and every message the bot sends back is stored
+# in messages and folded into conversations. The webhook only appends to an
+# in-memory buffer; a background thread writes it with insert_many once
+# TRANSCRIPT_BATCH_SIZE messages are waiting or the oldest has waited
+# TRANSCRIPT_FLUSH_SECONDS.
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "200"))
+TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", "1"))
+# Retried records go back to the front of the buffer, so their token is never
+# more than a few flushes old when they are stored again
+APPLIED_BATCHES_KEPT = 20
+
+
+def _only_duplicate_keys(error):
+    """True when a BulkWriteError failed on nothing but unique-index conflicts."""
+    errors = error.details.get("writeErrors", [])
+    return not error.details.get("writeConcernErrors") and all(err.get("code") == 11000 for err in errors)
+
+
+def _store_transcript_batch(batch):
+    """
+    Store buffered records ({"stage": ..., "message": doc}) in three steps:
+    insert the messages, fold them into conversations, add them to the unread
+    total. Each record remembers the last step it completed and the token of
+    the first attempt that got past the insert. Conversations and the counter
+    document keep the last APPLIED_BATCHES_KEPT tokens they were incremented
+    for, so a retry after a partial failure or a lost reply counts nothing twice.
+    """
+    fresh = [r for r in batch if r["stage"] == "new"]
+    if fresh:
+        skipped = set()
+        try:
+            messages_collection.insert_many([r["message"] for r in fresh], ordered=False)
+        except BulkWriteError as e:
+            if not _only_duplicate_keys(e):
+                raise
+            # Same _id: an earlier attempt stored it. Same mid under another _id:
+            # a redelivered webhook, already stored and counted the first time.
+            conflicts = [fresh[err["index"]]["message"]["_id"] for err in e.details["writeErrors"]]
+            stored = {doc["_id"] for doc in messages_collection.find({"_id": {"$in": conflicts}}, {"_id": 1})}
+            skipped = set(conflicts) - stored
+        token = ObjectId()
+        for r in fresh:
+            r.update(stage="done" if r["message"]["_id"] in skipped else "stored", token=token)
+
+    threads, latest = {}, {}
+    for r in batch:
+        if r["stage"] != "stored":
+            continue
+        m = r["message"]
+        thread = threads.setdefault((m["sender_id"], r["token"]), {"count": 0, "unread": 0})
+        thread["count"] += 1
+        thread["unread"] += m["direction"] == "in"
+        if m["sender_id"] not in latest or m["timestamp"] >= latest[m["sender_id"]]["timestamp"]:
+            latest[m["sender_id"]] = m
+
+    if threads:
+        def last_fields(sender):
+            m = latest[sender]
+            return {"last_text": m["text"], "last_direction": m["direction"], "last_at": m["timestamp"]}
+
+        increments = [
+            (
+                {"_id": sender, "applied_batches": {"$ne": token}},
+                {
+                    "$inc": {"message_count": thread["count"], "unread": thread["unread"]},
+                    "$push": {"applied_batches": {"$each": [token], "$slice": -APPLIED_BATCHES_KEPT}},
+                    "$setOnInsert": last_fields(sender)
+                }
+            )
+            for (sender, token), thread in threads.items()
+        ]
+        ops = [UpdateOne(query, update, upsert=True) for query, update in increments]
+        # Batches can be stored out of order; never move last_at backwards
+        ops += [
+            UpdateOne({"_id": sender, "last_at": {"$lt": m["timestamp"]}}, {"$set": last_fields(sender)})
+            for sender, m in latest.items()
+        ]
+        try:
+            conversations_collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            if not _only_duplicate_keys(e):
+                raise
+            # The upsert found no document without the token, so it tried to create
+            # one: either the token is applied already or a new thread raced us
+            conversations_collection.bulk_write([
+                UpdateOne(*increments[err["index"]]) for err in e.details["writeErrors"]
+            ], ordered=False)
+        for r in batch:
+            if r["stage"] == "stored":
+                r["stage"] = "counted"
+
+    unread = {}
+    for r in batch:
+        if r["stage"] == "counted":
+            unread[r["token"]] = unread.get(r["token"], 0) + (r["message"]["direction"] == "in")
+    for token, count in unread.items():
+        if count:
+            adjust_unread_total(count, token)
+        for r in batch:
+            if r["stage"] == "counted" and r["token"] == token:
+                r["stage"] = "done"
+
+
+transcript_buffer = WriteBehindBuffer(
+    _store_transcript_batch,
+    max_items=TRANSCRIPT_BATCH_SIZE,
+    max_delay=TRANSCRIPT_FLUSH_SECONDS,
+    name="transcripts"
+)
+
+
+def record_message(sender_id, direction, text, at=None, mid=None):
+    """
+    Queue one Messenger message ("in" from the sender, "out" from the bot) for
+    storage. mid is Messenger's message id; a redelivered one is stored once.
+    """
+    message = {
+        # Assigned here so a retried insert can recognise what is already stored
+        "_id": ObjectId(),
+        "sender_id": str(sender_id),
+        "direction": direction,
+        "text": text,
+        "timestamp": at or datetime.now(),
+        # The bot's own messages never count as unread
+        "read": direction == "out"
+    }
+    if mid:
+        message["mid"] = mid
+    transcript_buffer.add({"stage": "new", "message": message})
+
+
+def inbound_text(event):
+    """What the sender sent, as the inbox shows it; None for delivery/read receipts and echoes."""
+    if "postback" in event:
+        return event["postback"].get("title") or event["postback"].get("payload")
+    message = event.get("message")
+    if not message or message.get("is_echo"):
+        return None
+    if message.get("text"):
+        return message["text"]
+    kinds = [att.get("type", "file") for att in message.get("attachments", [])]
+    return " ".join(f"[{kind}]" for kind in kinds) or None
 
 
 
 from datetime import datetime, date
 
 @app.route("/appointments")
+@cached_view("appointment", "payment")
 def appointments():
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    appts = list(appointments_collection.find())
+    appts = list(appointments_collection.find({}, APPOINTMENT_LIST_PROJECTION))
     today = date.today().strftime("%Y-%m-%d")
 
     for a in appts:
-        a["_id"] = str(a["_id"])
-
         # Convert single service string to services array
         if "service" in a:
             a["services"] = [{"name": a["service"]}]
@@ -377,23 +1802,27 @@ def mark_appointment_done():
 
     if not appt_id:
         return jsonify(success=False, error="Missing appointment ID"), 400
+    try:
+        version = parse_version(data.get("version"))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
 
-    result = appointments_collection.update_one(
-        {"_id": ObjectId(appt_id)},
-        {"$set": {
-            "status": "done",
-            "completed_at": datetime.now()
-        }}
+    appt = apply_transition(
+        appointments_collection, "mark_done", appt_id,
+        expected_version=version, projection={"_id": 1}
     )
 
-    if result.modified_count == 1:
+    if appt:
         return jsonify(success=True, message="Appointment marked as completed!")
 
-    return jsonify(success=False, error="Appointment not found"), 404
+    error, code = describe_failure(appointments_collection, appt_id, "mark_done")
+    return jsonify(success=False, error=error), code
 
 
 @app.route("/appointments/<appt_id>/reschedule", methods=["GET", "POST"])
 def reschedule_appointment(appt_id):
+    if not ObjectId.is_valid(appt_id):
+        return "Appointment not found", 404
     appt = appointments_collection.find_one({"_id": ObjectId(appt_id)})
 
     if not appt:
@@ -405,16 +1834,20 @@ def reschedule_appointment(appt_id):
         
         # Convert to 24-hour format for storage if needed
         new_time_24h = to_24h(new_time)
+        try:
+            version = parse_version(request.form.get("version"))
+        except ValueError as e:
+            return str(e), 400
 
         # TODO: validate availability if needed
-        appointments_collection.update_one(
-            {"_id": ObjectId(appt_id)},
-            {"$set": {
-                "date": new_date,
-                "time": new_time_24h,
-                "status": "rescheduled"
-            }}
+        updated = apply_transition(
+            appointments_collection, "reschedule", appt_id,
+            fields={"date": new_date, "time": new_time_24h},
+            expected_version=version
         )
+        if not updated:
+            error, code = describe_failure(appointments_collection, appt_id, "reschedule")
+            return error, code
 
         # OPTIONAL: notify user via Messenger
         send_message(
@@ -442,19 +1875,19 @@ def reschedule_appointment_post():
         
         # Store time in 24-hour format (assuming new_time is already in HH:MM format from time input)
         new_time_24h = new_time
-
-        appt = appointments_collection.find_one({"_id": ObjectId(appt_id)})
-        if not appt:
-            return jsonify(success=False, error="Appointment not found"), 404
-
-        appointments_collection.update_one(
-            {"_id": ObjectId(appt_id)},
-            {"$set": {
-                "date": new_date,
-                "time": new_time_24h,
-                "status": "rescheduled"
-            }}
+        try:
+            version = parse_version(request.form.get("version"))
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
+
+        appt = apply_transition(
+            appointments_collection, "reschedule", appt_id,
+            fields={"date": new_date, "time": new_time_24h},
+            expected_version=version
         )
+        if not appt:
+            error, code = describe_failure(appointments_collection, appt_id, "reschedule")
+            return jsonify(success=False, error=error), code
 
         # Messenger notify 
         try:
@@ -479,18 +1912,18 @@ def reschedule_appointment_post():
 def cancel_appointment_post():
     try:
         appt_id = request.form["appt_id"]
+        try:
+            version = parse_version(request.form.get("version"))
+        except ValueError as e:
+            return jsonify(success=False, error=str(e)), 400
 
-        appt = appointments_collection.find_one({"_id": ObjectId(appt_id)})
-        if not appt:
-            return jsonify(success=False, error="Appointment not found"), 404
-
-        appointments_collection.update_one(
-            {"_id": ObjectId(appt_id)},
-            {"$set": {
-                "status": "cancelled",
-                "cancelled_at": datetime.now()
-            }}
+        appt = apply_transition(
+            appointments_collection, "cancel", appt_id,
+            expected_version=version
         )
+        if not appt:
+            error, code = describe_failure(appointments_collection, appt_id, "cancel")
+            return jsonify(success=False, error=error), code
 
         # Notify user on Messenger
         try:
@@ -513,24 +1946,22 @@ def cancel_appointment_post():
 
 @app.route("/cancel-appointment/<appointment_id>", methods=["POST"])
 def cancel_appointment(appointment_id):
-    result = appointments_collection.update_one(
-        {"_id": ObjectId(appointment_id)},
-        {"$set": {"status": "cancelled"}}
+    appt = apply_transition(
+        appointments_collection, "cancel", appointment_id, projection={"_id": 1}
     )
-    return jsonify({"success": result.modified_count > 0})
+    return jsonify({"success": appt is not None})
 
 
 @app.route("/payments")
+@cached_view("appointment", "payment")
 def payments():
     if "user_id" not in session:
         return redirect(url_for("login"))
     
     payments = list(appointments_collection.find({
-        "payment_status": {"$exists": True}
-    }).sort("created_at", -1))
-
-    for p in payments:
-        p["_id"] = str(p["_id"])
+        "payment_status": {"$exists": True},
+        "archived": {"$ne": True}
+    }, PAYMENT_LIST_PROJECTION).sort("created_at", -1))
 
     return render_template("payments.html", payments=payments)
 
@@ -670,6 +2101,7 @@ def update_payment_amount():
         )
         
         if result.modified_count > 0 or result.matched_count > 0:
+            record_changes("payment", [appointment_id], "update_amount")
             return jsonify({"success": True})
         else:
             return jsonify({"success": False, "error": "Appointment not found"})
@@ -680,36 +2112,11 @@ def update_payment_amount():
 
 
 
-@app.route("/api/payments/approve", methods=["POST"])
-def approve_payment():
-    data = request.json
-    appointment_id = data["appointment_id"]
-    amount = data.get("amount")  # Get the amount from the request
-    
-    appt = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-    if not appt:
-        return {"success": False}
-    
-    # Update appointment with payment status and amount
-    update_data = {
-        "payment_status": "approved",
-        "status": "confirmed"
-    }
-    
-    if amount:
-        update_data["downpayment"] = float(amount)
-    
-    appointments_collection.update_one(
-        {"_id": ObjectId(appointment_id)},
-        {"$set": update_data}
-    )
-    
-    # Get the service details to determine payment message
-    service = services_collection.find_one({"name": appt['service']})
-    
+def build_payment_approved_message(appt, service, amount=None):
+    """Messenger text sent to the patient once their payment is approved."""
     if not service:
         # Fallback if service not found
-        payment_message = f"Amount Paid: ₱{amount:,.2f}" if amount else ""
+        payment_message = f"Amount Paid: ₱{float(amount):,.2f}" if amount else ""
     else:
         full_price = service.get('price', 0)
         downpayment_required = service.get('downpayment', 0)
@@ -725,10 +2132,8 @@ def approve_payment():
             # Partial payment (more than downpayment but less than full)
             remaining = full_price - amount_paid
             payment_message = f"✅ Payment received: ₱{amount_paid:,.2f}\n💰 Remaining balance: ₱{remaining:,.2f}"
-    
-    # Notify user via Messenger
-    send_message(
-        appt["user_id"],
+
+    return (
         f"✅ Payment Approved! Your appointment is booked!\n\n"
         f"Fullname: {appt['fullname']}\n"
         f"Service: {appt['service']}\n"
@@ -737,6 +2142,218 @@ def approve_payment():
         f"Payment Method: {appt['payment_method']}\n\n"
         f"{payment_message}"
     )
+
+
+# -----------------------------
+# PENDING PAYMENTS REVIEW QUEUE
+# -----------------------------
+PAYMENT_CLAIM_LEASE = timedelta(minutes=5)
+PAYMENT_QUEUE_MAX_LIMIT = 100
+
+# Only what the review list renders; the proof image is served separately
+PAYMENT_QUEUE_PROJECTION = {
+    "fullname": 1,
+    "service": 1,
+    "date": 1,
+    "time": 1,
+    "downpayment": 1,
+    "payment_method": 1,
+    "payment_proof_file_id": 1,
+    "created_at": 1,
+    "claimed_by": 1,
+    "claimed_by_name": 1,
+    "claim_expires": 1,
+    "version": 1
+}
+
+CLAIM_FIELDS_UNSET = {"claimed_by": "", "claimed_by_name": "", "claim_expires": ""}
+
+
+def claim_available_filter(user_id, now=None):
+    """Match items with no active claim, or a claim held by this admin."""
+    now = now or datetime.now()
+    return {"$or": [
+        {"claimed_by": {"$in": [None, user_id]}},
+        {"claim_expires": {"$lte": now}}
+    ]}
+
+
+def encode_queue_cursor(appt):
+    # Bookings stored without created_at sort first, as null
+    created_at = appt.get("created_at")
+    return f"{created_at.isoformat() if created_at else ''}_{appt['_id']}"
+
+
+def decode_queue_cursor(cursor):
+    created_at, _, appt_id = cursor.rpartition("_")
+    return (datetime.fromisoformat(created_at) if created_at else None), ObjectId(appt_id)
+
+
+@app.route("/api/payments/queue")
+def payment_review_queue():
+    """
+    Keyset-paginated list of pending payments, oldest first.
+    Pass the returned next_cursor as ?after= to get the following page.
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    try:
+        limit = min(int(request.args.get("limit", 20)), PAYMENT_QUEUE_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid limit"}), 400
+
+    query = {"payment_status": "pending"}
+
+    after = request.args.get("after")
+    if after:
+        try:
+            created_at, appt_id = decode_queue_cursor(after)
+        except Exception:
+            return jsonify({"success": False, "error": "Invalid cursor"}), 400
+        query["$or"] = [
+            # Any date sorts after null, but $gt does not compare across types
+            {"created_at": {"$gt": created_at} if created_at else {"$ne": None}},
+            {"created_at": created_at, "_id": {"$gt": appt_id}}
+        ]
+
+    now = datetime.now()
+    if request.args.get("available") == "1":
+        query = {"$and": [query, claim_available_filter(session["user_id"], now)]}
+
+    items = list(
+        appointments_collection.find(query, PAYMENT_QUEUE_PROJECTION)
+        .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+        .limit(limit)
+    )
+
+    results = []
+    for appt in items:
+        claimed = appt.get("claimed_by") and appt.get("claim_expires") and appt["claim_expires"] > now
+        results.append({
+            "_id": str(appt["_id"]),
+            "fullname": appt.get("fullname"),
+            "service": appt.get("service"),
+            "date": appt.get("date"),
+            "time": to_ampm(appt.get("time", "")),
+            "downpayment": appt.get("downpayment", 0),
+            "payment_method": appt.get("payment_method"),
+            "has_stored_proof": bool(appt.get("payment_proof_file_id")),
+            "created_at": appt["created_at"].isoformat() if appt.get("created_at") else None,
+            "claimed_by": appt["claimed_by"] if claimed else None,
+            "claimed_by_name": appt.get("claimed_by_name") if claimed else None,
+            "version": appt.get("version", 0)
+        })
+
+    next_cursor = encode_queue_cursor(items[-1]) if len(items) == limit else None
+
+    return jsonify({
+        "success": True,
+        "items": results,
+        "next_cursor": next_cursor,
+        # Served from the (payment_status, created_at, _id) index
+        "pending_count": appointments_collection.count_documents({"payment_status": "pending"})
+    })
+
+
+@app.route("/api/payments/claim", methods=["POST"])
+def claim_payment():
+    """Lease a pending payment to the current admin so nobody else reviews it."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    data = request.get_json(silent=True)
+    appointment_id = data.get("appointment_id") if isinstance(data, dict) else None
+    if not appointment_id:
+        return jsonify({"success": False, "error": "Missing appointment_id"}), 400
+    if not ObjectId.is_valid(appointment_id):
+        return jsonify({"success": False, "error": "Invalid appointment_id"}), 400
+
+    now = datetime.now()
+    appt = appointments_collection.find_one_and_update(
+        {
+            "_id": ObjectId(appointment_id),
+            "payment_status": "pending",
+            **claim_available_filter(session["user_id"], now)
+        },
+        {"$set": {
+            "claimed_by": session["user_id"],
+            "claimed_by_name": session.get("fullname"),
+            "claim_expires": now + PAYMENT_CLAIM_LEASE
+        }},
+        projection={"claim_expires": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if not appt:
+        return jsonify({
+            "success": False,
+            "error": "Payment was already processed or is being reviewed by another admin"
+        }), 409
+
+    record_changes("payment", [appointment_id], "claim")
+    return jsonify({"success": True, "claim_expires": appt["claim_expires"].isoformat()})
+
+
+@app.route("/api/payments/release", methods=["POST"])
+def release_payment_claim():
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    data = request.get_json(silent=True)
+    appointment_id = data.get("appointment_id") if isinstance(data, dict) else None
+    if not appointment_id:
+        return jsonify({"success": False, "error": "Missing appointment_id"}), 400
+    if not ObjectId.is_valid(appointment_id):
+        return jsonify({"success": False, "error": "Invalid appointment_id"}), 400
+
+    result = appointments_collection.update_one(
+        {"_id": ObjectId(appointment_id), "claimed_by": session["user_id"]},
+        {"$unset": CLAIM_FIELDS_UNSET}
+    )
+    if result.modified_count == 1:
+        record_changes("payment", [appointment_id], "release")
+    return jsonify({"success": result.modified_count == 1})
+
+
+@app.route("/api/payments/approve", methods=["POST"])
+def approve_payment():
+    data = request.json
+    appointment_id = data["appointment_id"]
+    amount = data.get("amount")  # Get the amount from the request
+    
+    # Update appointment with payment status and amount
+    update_data = {
+        "payment_status": "approved"
+    }
+    
+    if amount:
+        update_data["downpayment"] = float(amount)
+    try:
+        version = parse_version(data.get("version"))
+    except ValueError as e:
+        return {"success": False, "error": str(e)}, 400
+    
+    # Only a still-pending payment that nobody else has claimed can be approved,
+    # so two admins clicking at once can't both notify the patient
+    appt = apply_transition(
+        appointments_collection, "approve_payment", appointment_id,
+        fields=update_data,
+        unset=CLAIM_FIELDS_UNSET,
+        expected_version=version,
+        extra_filter={
+            "payment_status": "pending",
+            **claim_available_filter(session.get("user_id"))
+        }
+    )
+    if not appt:
+        return {
+            "success": False,
+            "error": "Payment was already processed or is being reviewed by another admin"
+        }, 409
+    
+    # Notify user via Messenger, priced from the booking-time snapshot
+    send_message(appt["user_id"], build_payment_approved_message(appt, appointment_pricing(appt), amount))
     
     return {"success": True}
 
@@ -757,15 +2374,21 @@ def book():
         # Convert to 24-hour format for storage
         time_24h = to_24h(time)
 
-        appointments_collection.insert_one({
+        # Capture the service's current price/duration with the booking
+        service_doc = services_collection.find_one({"name": service})
+
+        inserted = appointments_collection.insert_one({
             "user_id": session["user_id"],
             "fullname": session["fullname"],
             "service": service,
+            **service_snapshot(service_doc),
             "date": date,
             "time": time_24h,
             "status": "pending",
+            "version": 0,
             "created_at": datetime.now()
         })
+        record_changes("appointment", [inserted.inserted_id], "create")
 
         flash("Appointment submitted!", "success")
         return redirect(url_for("my_appointments"))
@@ -821,7 +2444,7 @@ def send_message(recipient_id, text, quick_replies=None, attachment=None):
     """
     Send a text message, optional quick replies or attachment (e.g., carousel) to Messenger.
     """
-    url = "https://graph.facebook.com/v17.0/me/messages"
+    url = f"{GRAPH_API_URL}/me/messages"
     payload = {"recipient": {"id": recipient_id}}
 
     if attachment:
@@ -840,18 +2463,40 @@ def send_message(recipient_id, text, quick_replies=None, attachment=None):
             timeout=5  # 5 second timeout
         )
         response.raise_for_status()
-        return True
     except requests.exceptions.RequestException as e:
         print(f"Error sending message to {recipient_id}: {e}")
         return False
 
+    if attachment:
+        template = attachment.get("payload", {}).get("template_type") or attachment.get("type")
+        record_message(recipient_id, "out", f"[{template}]")
+    else:
+        record_message(recipient_id, "out", text)
+    return True
+
+
+# Outgoing notifications that should not hold up an admin request
+notification_queue = queue.Queue()
+
+
+def _send_notification(notification):
+    recipient_id, text = notification
+    send_message(recipient_id, text)
+
+
+def queue_notifications(notifications):
+    """Queue (recipient_id, text) pairs to be sent to Messenger in the background."""
+    for recipient_id, text in notifications:
+        if recipient_id:
+            submit_background(notification_queue, _send_notification, (recipient_id, text))
+
 
 # -----------------------------
 # SEND MAIN MENU (3 BUTTONS - NO CONTACT INFO)
 # -----------------------------
 def send_main_menu(recipient_id):
     """Send main menu with only 3 buttons (Contact Info is in persistent menu)"""
-    url = "https://graph.facebook.com/v17.0/me/messages"
+    url = f"{GRAPH_API_URL}/me/messages"
     
     payload = {
         "recipient": {"id": recipient_id},
@@ -918,13 +2563,36 @@ def send_services_carousel(recipient_id):
 # -----------------------------
 # SEND DATE QUICK REPLIES
 # -----------------------------
-def send_date_quick_replies(recipient_id):
-    quick_replies = [
+EARLIEST_SLOT_OPTIONS = 4
+
+
+def send_date_quick_replies(recipient_id, duration=None):
+    """
+    Ask for a date. When the service duration is known, the earliest actual
+    openings are offered first so the patient doesn't have to guess a day.
+    """
+    quick_replies = []
+    if duration:
+        try:
+            for day, time_24h in find_earliest_slots(duration, EARLIEST_SLOT_OPTIONS):
+                label = datetime.strptime(day, "%Y-%m-%d").strftime("%a %b %d")
+                quick_replies.append({
+                    "content_type": "text",
+                    "title": f"{label} {to_ampm(time_24h)}",
+                    "payload": f"SLOT_{day}_{time_24h}"
+                })
+        except Exception as e:
+            print(f"Error finding earliest slots: {e}")
+
+    quick_replies += [
         {"content_type": "text", "title": "Tomorrow", "payload": "DATE_TOMORROW"},
         {"content_type": "text", "title": "Next Monday", "payload": "DATE_NEXT_MONDAY"},
         {"content_type": "text", "title": "Pick a Date", "payload": "DATE_PICK"}
     ]
-    send_message(recipient_id, "When would you like your appointment?", quick_replies=quick_replies)
+    text = "When would you like your appointment?"
+    if len(quick_replies) > 3:
+        text = "⚡ Earliest openings are listed first, or pick another day:"
+    send_message(recipient_id, text, quick_replies=quick_replies)
 
 
 # -----------------------------
@@ -1082,15 +2750,38 @@ def handle_user_message(sender, text):
             state["service_id"] = str(service["_id"])
             state["service_name"] = service["name"]
             state["downpayment"] = service.get("downpayment", 0)
+            state["service_duration"] = int(service.get("duration") or DEFAULT_DURATION)
             state["step"] = "choose_date"
 
             send_message(sender, f"✅ You selected: {service['name']}")
-            send_date_quick_replies(sender)
+            send_date_quick_replies(sender, state.get("service_duration"))
             return
 
         send_services_carousel(sender)
         return
 
+    # -------------------------
+    # STEP 2 (SHORTCUT): EARLIEST OPENING PICKED
+    # -------------------------
+    if state["step"] in ("choose_date", "awaiting_manual_date") and text.startswith("SLOT_"):
+        try:
+            _, slot_date, slot_time = text.split("_", 2)
+            available = is_time_available(slot_date, slot_time, state.get("service_duration"))
+        except ValueError:
+            available = False
+
+        if not available:
+            send_message(sender, "❌ Sorry, that time was just taken.\n\nPlease choose another option.")
+            state["step"] = "choose_date"
+            send_date_quick_replies(sender, state.get("service_duration"))
+            return
+
+        state["date"] = slot_date
+        state["time"] = slot_time
+        state["step"] = "ask_name"
+        send_message(sender, "📝 Please type your full name for the appointment:")
+        return
+
     # -------------------------
     # STEP 2: CHOOSE DATE
     # -------------------------
@@ -1113,7 +2804,7 @@ def handle_user_message(sender, text):
 
         try:
             print(f"Fetching free times for {text}...")  # Debug log
-            free_times = get_free_times_for_date(text)
+            free_times = get_free_times_for_date(text, state.get("service_duration"))
             print(f"Got {len(free_times)} free times")  # Debug log
             
         except Exception as e:
@@ -1122,13 +2813,13 @@ def handle_user_message(sender, text):
                 sender,
                 "❌ Sorry, there was an error checking availability.\n\nPlease try selecting a different date."
             )
-            send_date_quick_replies(sender)
+            send_date_quick_replies(sender, state.get("service_duration"))
             return
 
         # Check if any times are available
         if not free_times or len(free_times) == 0:
             send_message(sender, "❌ No available times on this date.\n\nPlease choose another date.")
-            send_date_quick_replies(sender)
+            send_date_quick_replies(sender, state.get("service_duration"))
             return
 
         # Times are already in AM/PM format from function
@@ -1162,7 +2853,7 @@ def handle_user_message(sender, text):
         
         try:
             print(f"Fetching free times for manual date {text}...")
-            free_times = get_free_times_for_date(text)
+            free_times = get_free_times_for_date(text, state.get("service_duration"))
             print(f"Got {len(free_times)} free times")
             
         except Exception as e:
@@ -1172,13 +2863,13 @@ def handle_user_message(sender, text):
                 "❌ Sorry, there was an error checking availability.\n\nPlease try a different date."
             )
             state["step"] = "choose_date"
-            send_date_quick_replies(sender)
+            send_date_quick_replies(sender, state.get("service_duration"))
             return
 
         if not free_times or len(free_times) == 0:
             send_message(sender, "❌ No available times on this date.\n\nPlease choose another date.")
             state["step"] = "choose_date"
-            send_date_quick_replies(sender)
+            send_date_quick_replies(sender, state.get("service_duration"))
             return
 
         # Times in AM/PM format
@@ -1202,6 +2893,19 @@ def handle_user_message(sender, text):
             print(f"Error converting time: {e}")
             send_message(sender, "❌ Invalid time format. Please select a time from the options.")
             return
+
+        # Someone else may have taken the slot since the options were sent
+        try:
+            available = is_time_available(state["date"], state["time"], state.get("service_duration"))
+        except ValueError:
+            send_message(sender, "❌ Invalid time format. Please select a time from the options.")
+            return
+
+        if not available:
+            send_message(sender, "❌ Sorry, that time was just taken.\n\nPlease choose another date.")
+            state["step"] = "choose_date"
+            send_date_quick_replies(sender, state.get("service_duration"))
+            return
             
         state["step"] = "ask_name"
         send_message(sender, "📝 Please type your full name for the appointment:")
@@ -1227,6 +2931,7 @@ def handle_user_message(sender, text):
 
         downpayment = service.get("downpayment", 0)
         state["downpayment"] = downpayment
+        state["service_snapshot"] = service_snapshot(service)
         state["step"] = "confirm_downpayment"
 
         send_message(
@@ -1303,6 +3008,7 @@ def handle_user_message(sender, text):
                 "fullname": state["fullname"],
                 "user_id": sender,
                 "service": state["service_name"],
+                **state.get("service_snapshot", {}),
                 "date": state["date"],
                 "time": state["time"],  # Stored in 24-hour format
                 "downpayment": state["downpayment"],
@@ -1310,11 +3016,16 @@ def handle_user_message(sender, text):
                 "payment_proof": text,
                 "payment_status": "pending",
                 "status": "pending",
+                "version": 0,
                 "created_at": datetime.now()
             }).inserted_id
 
             state["appointment_id"] = str(appointment_id)
             state["step"] = "waiting_admin"
+            record_changes("payment", [appointment_id], "create")
+
+            # Copy the CDN image into GridFS before the URL expires
+            enqueue_proof_ingest(appointment_id)
 
             send_message(
                 sender,
@@ -1342,7 +3053,10 @@ def handle_user_message(sender, text):
         
         # FIX: Call function directly instead of HTTP request
         try:
-            free_times = get_free_times_for_date(text)
+            state["duration"] = get_appointment_duration(state["appointment_id"])
+            free_times = get_free_times_for_date(
+                text, state["duration"], exclude_id=state["appointment_id"]
+            )
         except Exception as e:
             print(f"Error fetching times for reschedule: {e}")
             send_message(sender, "❌ Error checking availability. Please try again.")
@@ -1366,18 +3080,18 @@ def handle_user_message(sender, text):
         try:
             new_time_24h = to_24h(text)
             
-            appointments_collection.update_one(
-                {"_id": ObjectId(state["appointment_id"])},
-                {
-                    "$set": {
-                        "date": state["new_date"],
-                        "time": new_time_24h,
-                        "status": "rescheduled",
-                        "updated_at": datetime.now()
-                    }
-                }
+            updated = apply_transition(
+                appointments_collection, "reschedule", state["appointment_id"],
+                fields={"date": state["new_date"], "time": new_time_24h},
+                extra_filter={"user_id": sender},
+                projection={"_id": 1}
             )
 
+            if not updated:
+                send_message(sender, "❌ This appointment can no longer be rescheduled.")
+                user_state[sender] = {"step": None}
+                return
+
             send_message(
                 sender,
                 f"✅ **Appointment Rescheduled!**\n\n📅 New Date: {state['new_date']}\n⏰ New Time: {text}"
@@ -1402,16 +3116,17 @@ def handle_user_message(sender, text):
 
         if text == "CANCEL_YES":
             try:
-                appointments_collection.update_one(
-                    {"_id": ObjectId(state["appointment_id"])},
-                    {
-                        "$set": {
-                            "status": "cancelled",
-                            "updated_at": datetime.now()
-                        }
-                    }
+                cancelled = apply_transition(
+                    appointments_collection, "cancel", state["appointment_id"],
+                    extra_filter={"user_id": sender},
+                    projection={"_id": 1}
                 )
 
+                if not cancelled:
+                    send_message(sender, "ℹ️ This appointment is no longer active.")
+                    user_state[sender] = {"step": None}
+                    return
+
                 send_message(sender, "❌ Your appointment has been cancelled.")
                 user_state[sender] = {"step": None}
             except Exception as e:
@@ -1427,6 +3142,31 @@ def handle_user_message(sender, text):
 
 
 
+# -----------------------------
+# WEBHOOK RECORDING (opt-in, replayed with bench/replay.py)
+# -----------------------------
+# With WEBHOOK_RECORD_DIR set, every webhook POST is written there, sanitized
+# (see webhook_log.py), with its arrival and handling time. The writing
+# happens on a background thread so recording does not slow the webhook down.
+WEBHOOK_RECORD_DIR = os.getenv("WEBHOOK_RECORD_DIR")
+webhook_record_queue = queue.Queue()
+_webhook_log = WebhookLogWriter(WEBHOOK_RECORD_DIR) if WEBHOOK_RECORD_DIR else None
+
+
+def _write_webhook_record(record):
+    record["body"] = sanitize_webhook_body(record["body"], app.config["SECRET_KEY"])
+    # Flush once a burst has been written rather than after every line
+    _webhook_log.write(record, flush=webhook_record_queue.empty())
+
+
+def record_webhook(body, received_at, started):
+    if _webhook_log is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    submit_background(webhook_record_queue, _write_webhook_record,
+                      {"t": received_at, "ms": round(elapsed_ms, 2), "body": body})
+
+
 # MESSENGER WEBHOOK
 # -----------------------------
 @app.route("/webhook", methods=["GET", "POST"])
@@ -1438,12 +3178,19 @@ def webhook():
             return challenge
         return "Invalid verification token", 403
 
+    received_at, started = time.time(), time.perf_counter()
     data = request.get_json()
     if "entry" in data:
         for entry in data["entry"]:
             for event in entry.get("messaging", []):
                 sender = event["sender"]["id"]
 
+                text = inbound_text(event)
+                if text is not None:
+                    sent_at = datetime.fromtimestamp(event["timestamp"] / 1000) if event.get("timestamp") else None
+                    mid = (event.get("message") or event.get("postback") or {}).get("mid")
+                    record_message(sender, "in", text, sent_at, mid)
+
                 # -----------------------------
                 # HANDLE POSTBACKS (CAROUSEL & MENU)
                 # -----------------------------
@@ -1523,6 +3270,13 @@ def webhook():
                             handle_user_message(sender, "date_manual")
                             continue
 
+                        # -----------------------------
+                        # EARLIEST OPENING (DATE + TIME)
+                        # -----------------------------
+                        if payload.startswith("SLOT_"):
+                            handle_user_message(sender, payload)
+                            continue
+
                         # -----------------------------
                         # PREDEFINED DATE QUICK REPLIES
                         # -----------------------------
@@ -1597,11 +3351,12 @@ def webhook():
                     
                         handle_user_message(sender, text)
 
+    record_webhook(data, received_at, started)
     return "OK", 200
 
 def notify_payment_approved(appointment):
-    # Get the service details to compare amounts
-    service = services_collection.find_one({"name": appointment['service']})
+    # Compare against the prices captured when the appointment was booked
+    service = appointment_pricing(appointment)
     
     if not service:
         # Fallback if service not found
@@ -1735,7 +3490,7 @@ def send_my_appointments_carousel(sender_id):
 
 def setup_persistent_menu():
     """Setup persistent menu with better error handling"""
-    url = f"https://graph.facebook.com/v17.0/me/messenger_profile"
+    url = f"{GRAPH_API_URL}/me/messenger_profile"
     
     # Simplified 3-button menu (no nested submenu)
     menu = {
@@ -1786,6 +3541,15 @@ def setup_persistent_menu():
         print(f"❌ Error setting up menu: {e}")
         return False
 
+def build_payment_declined_message(appointment, reason):
+    """Messenger text sent to the patient when their payment is declined."""
+    return (
+        f"❌ Your payment for {appointment.get('service')} on {appointment.get('date')} "
+        f"at {to_ampm(appointment.get('time'))} has been declined.\n"
+        f"Reason: {reason}\n"
+        "Please contact the clinic if you have questions."
+    )
+
 def notify_payment_declined(appointment, reason):
     """
     Notify the user via Messenger that their payment was declined.
@@ -1793,19 +3557,10 @@ def notify_payment_declined(appointment, reason):
     try:
         user_id = appointment.get("user_id")
         fullname = appointment.get("fullname")
-        service = appointment.get("service")
-        date = appointment.get("date")
-        time = appointment.get("time")
-        payment_method = appointment.get("payment_method")
 
         # Optional: send Messenger notification
         if user_id:
-            send_message(
-                user_id,
-                f"❌ Your payment for {service} on {date} at {to_ampm(time)} has been declined.\n"
-                f"Reason: {reason}\n"
-                "Please contact the clinic if you have questions."
-            )
+            send_message(user_id, build_payment_declined_message(appointment, reason))
         print(f"Payment declined for {fullname} ({appointment['_id']}): {reason}")
     except Exception as e:
         print("Error notifying user about declined payment:", e)
@@ -1820,23 +3575,27 @@ def decline_payment():
 
         if not appointment_id or not reason:
             return jsonify({"success": False, "error": "Missing appointment_id or reason"}), 400
-
-        appointment = appointments_collection.find_one({"_id": ObjectId(appointment_id)})
-        if not appointment:
-            return jsonify({"success": False, "error": "Appointment not found"}), 404
-
-        # Update payment status in DB
-        appointments_collection.update_one(
-            {"_id": ObjectId(appointment_id)},
-            {
-                "$set": {
-                    "payment_status": "declined",
-                    "status": "declined",
-                    "decline_reason": reason,
-                    "updated_at": datetime.now()
-                }
+        try:
+            version = parse_version(data.get("version"))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        # Update payment status in DB, only if it is still pending and unclaimed
+        appointment = apply_transition(
+            appointments_collection, "decline_payment", appointment_id,
+            fields={"payment_status": "declined", "decline_reason": reason},
+            unset=CLAIM_FIELDS_UNSET,
+            expected_version=version,
+            extra_filter={
+                "payment_status": "pending",
+                **claim_available_filter(session.get("user_id"))
             }
         )
+        if not appointment:
+            return jsonify({
+                "success": False,
+                "error": "Payment was already processed or is being reviewed by another admin"
+            }), 409
 
         # Notify user
         notify_payment_declined(appointment, reason)
@@ -1848,6 +3607,384 @@ def decline_payment():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# -----------------------------
+# BULK PAYMENT / COMPLETION ACTIONS
+# -----------------------------
+BULK_MAX_ITEMS = 200
+
+
+def parse_bulk_ids(raw_ids):
+    """
+    Split a list of id strings into valid ObjectIds and per-item errors.
+    Returns (ordered list of id strings, {id_str: ObjectId}, {id_str: error}).
+    """
+    order, valid, errors = [], {}, {}
+    for raw in raw_ids or []:
+        key = str(raw)
+        if key in valid or key in errors:
+            continue
+        order.append(key)
+        try:
+            valid[key] = ObjectId(key)
+        except Exception:
+            errors[key] = "Invalid appointment ID"
+    return order, valid, errors
+
+
+def apply_bulk_updates(ops_by_id):
+    """
+    Run UpdateOne ops in a single unordered bulk_write and report which ids
+    were actually modified. Every op tags its document with a batch id, so a
+    guard filter that no longer matches (e.g. another admin got there first)
+    shows up per item instead of only as an aggregate count.
+    """
+    if not ops_by_id:
+        return set()
+
+    batch_id = ObjectId()
+    requests_ = []
+    for oid, (guard, update) in ops_by_id.items():
+        update.setdefault("$set", {})["last_bulk_batch"] = batch_id
+        requests_.append(UpdateOne({"_id": oid, **guard}, update))
+
+    result = appointments_collection.bulk_write(requests_, ordered=False)
+    if result.modified_count == len(requests_):
+        return set(ops_by_id)
+
+    applied = appointments_collection.find(
+        {"_id": {"$in": list(ops_by_id)}, "last_bulk_batch": batch_id},
+        {"_id": 1}
+    )
+    return {a["_id"] for a in applied}
+
+
+def bulk_response(order, errors, applied_keys, not_applied_error):
+    results = []
+    for key in order:
+        if key in errors:
+            results.append({"appointment_id": key, "success": False, "error": errors[key]})
+        elif key in applied_keys:
+            results.append({"appointment_id": key, "success": True})
+        else:
+            results.append({"appointment_id": key, "success": False, "error": not_applied_error})
+    return jsonify({
+        "success": True,
+        "processed": len(applied_keys),
+        "results": results
+    })
+
+
+@app.route("/api/payments/bulk-approve", methods=["POST"])
+def bulk_approve_payments():
+    """
+    Approve many pending payments at once.
+    Body: {"items": [{"appointment_id": "...", "amount": 500}, ...]}
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    body = request.get_json(silent=True)
+    items = (body.get("items") if isinstance(body, dict) else None) or []
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return jsonify({"success": False, "error": "items must be a list of objects"}), 400
+    if not items or len(items) > BULK_MAX_ITEMS:
+        return jsonify({"success": False, "error": f"Send between 1 and {BULK_MAX_ITEMS} items"}), 400
+
+    amounts = {str(i.get("appointment_id")): i.get("amount") for i in items}
+    order, valid, errors = parse_bulk_ids(list(amounts))
+
+    now = datetime.now()
+    guard = {
+        **transition_guard("approve_payment"),
+        "payment_status": "pending",
+        **claim_available_filter(session["user_id"], now)
+    }
+
+    ops = {}
+    for key, oid in valid.items():
+        update_data = {"payment_status": "approved"}
+        if amounts.get(key):
+            try:
+                update_data["downpayment"] = float(amounts[key])
+            except (TypeError, ValueError):
+                errors[key] = "Invalid amount"
+                continue
+        ops[oid] = (guard, transition_update("approve_payment", update_data, CLAIM_FIELDS_UNSET, now))
+
+    applied = apply_bulk_updates(ops)
+    record_changes("payment", applied, "approve_payment")
+
+    # One read for the notification details; prices come from each booking's snapshot
+    approved = appointments_collection.find({"_id": {"$in": list(applied)}})
+
+    queue_notifications([
+        (a.get("user_id"), build_payment_approved_message(a, appointment_pricing(a)))
+        for a in approved
+    ])
+
+    return bulk_response(
+        order, errors, {str(oid) for oid in applied},
+        "Payment was already processed or is being reviewed by another admin"
+    )
+
+
+@app.route("/api/payments/bulk-decline", methods=["POST"])
+def bulk_decline_payments():
+    """
+    Decline many pending payments with the same reason.
+    Body: {"appointment_ids": ["...", ...], "reason": "..."}
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    data = request.get_json() or {}
+    raw_ids = data.get("appointment_ids") or []
+    reason = (data.get("reason") or "").strip()
+    if not reason:
+        return jsonify({"success": False, "error": "Missing reason"}), 400
+    if not raw_ids or len(raw_ids) > BULK_MAX_ITEMS:
+        return jsonify({"success": False, "error": f"Send between 1 and {BULK_MAX_ITEMS} ids"}), 400
+
+    order, valid, errors = parse_bulk_ids(raw_ids)
+
+    now = datetime.now()
+    guard = {
+        **transition_guard("decline_payment"),
+        "payment_status": "pending",
+        **claim_available_filter(session["user_id"], now)
+    }
+    ops = {
+        oid: (guard, transition_update(
+            "decline_payment",
+            {"payment_status": "declined", "decline_reason": reason},
+            CLAIM_FIELDS_UNSET,
+            now
+        ))
+        for oid in valid.values()
+    }
+
+    applied = apply_bulk_updates(ops)
+    record_changes("payment", applied, "decline_payment")
+
+    declined = appointments_collection.find(
+        {"_id": {"$in": list(applied)}},
+        {"user_id": 1, "service": 1, "date": 1, "time": 1}
+    )
+    queue_notifications([
+        (a.get("user_id"), build_payment_declined_message(a, reason)) for a in declined
+    ])
+
+    return bulk_response(
+        order, errors, {str(oid) for oid in applied},
+        "Payment was already processed or is being reviewed by another admin"
+    )
+
+
+@app.route("/api/appointments/bulk-mark-done", methods=["POST"])
+def bulk_mark_appointments_done():
+    """
+    Mark many appointments as completed.
+    Body: {"appointment_ids": ["...", ...]}
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    raw_ids = (request.get_json() or {}).get("appointment_ids") or []
+    if not raw_ids or len(raw_ids) > BULK_MAX_ITEMS:
+        return jsonify({"success": False, "error": f"Send between 1 and {BULK_MAX_ITEMS} ids"}), 400
+
+    order, valid, errors = parse_bulk_ids(raw_ids)
+
+    now = datetime.now()
+    guard = transition_guard("mark_done")
+    ops = {
+        oid: (guard, transition_update("mark_done", now=now))
+        for oid in valid.values()
+    }
+
+    applied = apply_bulk_updates(ops)
+    record_changes("appointment", applied, "mark_done")
+
+    return bulk_response(
+        order, errors, {str(oid) for oid in applied},
+        "Appointment not found or already closed"
+    )
+
+
+# -----------------------------
+# PAYMENT PROOF STORAGE (GridFS)
+# -----------------------------
+PROOF_THUMB_SIZE = (320, 320)
+PROOF_CACHE_MAX_AGE = 60 * 60 * 24 * 365  # proofs never change once stored
+
+proof_queue = queue.Queue()
+
+
+def enqueue_proof_ingest(appointment_id):
+    """Queue an appointment so its payment proof gets copied into GridFS."""
+    submit_background(proof_queue, ingest_payment_proof, str(appointment_id))
+
+
+def make_proof_thumbnail(data):
+    """Return a small JPEG thumbnail of the given image bytes."""
+    image = Image.open(BytesIO(data))
+    image.thumbnail(PROOF_THUMB_SIZE)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=75, optimize=True)
+    return out.getvalue()
+
+
+def ingest_payment_proof(appointment_id):
+    """
+    Download the Messenger CDN image for an appointment once and store the
+    original plus a thumbnail in GridFS. Returns True if a proof was stored.
+    """
+    appt = appointments_collection.find_one(
+        {"_id": ObjectId(appointment_id)},
+        {"payment_proof": 1, "payment_proof_file_id": 1}
+    )
+    if not appt or appt.get("payment_proof_file_id"):
+        return False
+
+    url = appt.get("payment_proof")
+    if not url or not url.startswith("http"):
+        return False
+
+    response = requests.get(url, timeout=15)
+    response.raise_for_status()
+    data = response.content
+    content_type = response.headers.get("Content-Type", "image/jpeg").split(";")[0].strip()
+    etag = hashlib.sha1(data).hexdigest()
+
+    file_id = proofs_fs.put(
+        data,
+        filename=f"{appointment_id}",
+        metadata={"appointment_id": appointment_id, "kind": "original"}
+    )
+
+    thumb_id = None
+    try:
+        thumb_id = proofs_fs.put(
+            make_proof_thumbnail(data),
+            filename=f"{appointment_id}-thumb.jpg",
+            metadata={"appointment_id": appointment_id, "kind": "thumbnail"}
+        )
+    except Exception as e:
+        # Not every attachment is a decodable image; the original is still kept
+        print(f"Could not create proof thumbnail for {appointment_id}: {e}")
+
+    result = appointments_collection.update_one(
+        {"_id": ObjectId(appointment_id), "payment_proof_file_id": {"$exists": False}},
+        {"$set": {
+            "payment_proof_file_id": file_id,
+            "payment_proof_thumb_id": thumb_id,
+            "payment_proof_content_type": content_type,
+            "payment_proof_etag": etag,
+            "payment_proof_ingested_at": datetime.now()
+        }}
+    )
+
+    if result.modified_count == 0:
+        # Another worker stored this proof first
+        proofs_fs.delete(file_id)
+        if thumb_id:
+            proofs_fs.delete(thumb_id)
+        return False
+
+    return True
+
+
+def queue_missing_payment_proofs():
+    """Queue every appointment whose proof has not been copied into GridFS yet."""
+    pending = appointments_collection.find(
+        {
+            "payment_proof": {"$regex": "^http"},
+            "payment_proof_file_id": {"$exists": False}
+        },
+        {"_id": 1}
+    )
+    count = 0
+    for appt in pending:
+        enqueue_proof_ingest(appt["_id"])
+        count += 1
+    return count
+
+
+def serve_payment_proof(appointment_id, thumbnail=False):
+    if not ObjectId.is_valid(appointment_id):
+        return "Payment proof not found", 404
+
+    appt = appointments_collection.find_one(
+        {"_id": ObjectId(appointment_id)},
+        {
+            "payment_proof": 1,
+            "payment_proof_file_id": 1,
+            "payment_proof_thumb_id": 1,
+            "payment_proof_content_type": 1,
+            "payment_proof_etag": 1
+        }
+    )
+    if not appt or not appt.get("payment_proof"):
+        return "Payment proof not found", 404
+
+    if not appt.get("payment_proof_file_id"):
+        # Not ingested yet: fall back to the original URL and fetch it in the background
+        enqueue_proof_ingest(appointment_id)
+        response = redirect(appt["payment_proof"])
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    file_id = appt["payment_proof_file_id"]
+    mimetype = appt.get("payment_proof_content_type") or "image/jpeg"
+    etag = appt["payment_proof_etag"]
+    if thumbnail and appt.get("payment_proof_thumb_id"):
+        file_id = appt["payment_proof_thumb_id"]
+        mimetype = "image/jpeg"
+        etag = f"{etag}-thumb"
+
+    # Answer revalidation without touching GridFS
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"private, max-age={PROOF_CACHE_MAX_AGE}, immutable"
+        return response
+
+    grid_out = proofs_fs.get(file_id)
+    response = send_file(
+        BytesIO(grid_out.read()),
+        mimetype=mimetype,
+        etag=etag,
+        max_age=PROOF_CACHE_MAX_AGE
+    )
+    response.headers["Cache-Control"] = f"private, max-age={PROOF_CACHE_MAX_AGE}, immutable"
+    return response
+
+
+@app.route("/payments/proof/<appointment_id>")
+def payment_proof_image(appointment_id):
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    return serve_payment_proof(appointment_id)
+
+
+@app.route("/payments/proof/<appointment_id>/thumb")
+def payment_proof_thumbnail(appointment_id):
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    return serve_payment_proof(appointment_id, thumbnail=True)
+
+
+@app.route("/api/payments/ingest-proofs", methods=["POST"])
+def ingest_payment_proofs():
+    """Queue any payment proofs still pointing at Messenger CDN URLs."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    queued = queue_missing_payment_proofs()
+    return jsonify({"success": True, "queued": queued})
+
+
 # -----------------------------
 # MENU MANAGEMENT ROUTES
 # -----------------------------
@@ -1865,7 +4002,7 @@ def setup_menu():
 @app.route("/check-menu")
 def check_menu():
     """Check if persistent menu is installed on Facebook"""
-    url = f"https://graph.facebook.com/v17.0/me/messenger_profile?fields=persistent_menu&access_token={PAGE_ACCESS_TOKEN}"
+    url = f"{GRAPH_API_URL}/me/messenger_profile?fields=persistent_menu&access_token={PAGE_ACCESS_TOKEN}"
     
     try:
         response = requests.get(url, timeout=10)
@@ -1895,22 +4032,22 @@ def check_menu():
 # -----------------------------
 
 @app.route("/get-services")
+@conditional_get("service")
+@cached_view("service", public=True)
 def get_services():
-    services = list(services_collection.find())
-    for s in services:
-        s["_id"] = str(s["_id"])
-    return jsonify(services)
+    return jsonify(list(services_collection.find()))
 
 
 @app.route("/add-service", methods=["POST"])
 def add_service():
     data = request.json
-    services_collection.insert_one({
+    service_id = services_collection.insert_one({
         "name": data["name"],
         "price": float(data["price"]),
         "downpayment": float(data["downpayment"]),
         "duration": int(data["duration"])
-    })
+    }).inserted_id
+    record_changes("service", [service_id], "create")
     return {"success": True}
 
 
@@ -1926,25 +4063,100 @@ def update_service():
             "duration": int(data["duration"])
         }}
     )
+    record_changes("service", [data["id"]], "update")
     return {"success": True}
 
 
 @app.route("/delete-service/<id>", methods=["DELETE"])
 def delete_service(id):
+    if not ObjectId.is_valid(id):
+        return {"success": False, "error": "Invalid service id"}, 400
     services_collection.delete_one({"_id": ObjectId(id)})
+    record_changes("service", [id], "delete")
     return {"success": True}
 
 
+# -----------------------------
+# SERVICE SNAPSHOTS ON APPOINTMENTS
+# -----------------------------
+def service_snapshot(service):
+    """
+    Fields copied onto an appointment at booking time so payment and report
+    code never has to look the service up by name again.
+    """
+    if not service:
+        return {}
+    return {
+        "service_id": service["_id"],
+        "service_price": float(service.get("price", 0)),
+        "service_downpayment": float(service.get("downpayment", 0)),
+        "service_duration": int(service.get("duration", 0))
+    }
+
+
+def appointment_pricing(appt):
+    """Price info from an appointment's snapshot, or None for unmigrated bookings."""
+    if appt.get("service_price") is None:
+        return None
+    return {
+        "price": appt["service_price"],
+        "downpayment": appt.get("service_downpayment", 0)
+    }
+
+
+def backfill_service_snapshots(batch_size=500):
+    """
+    Add service_id and the price/downpayment/duration snapshot to appointments
+    booked before snapshots existed. Matches by service name with one read of
+    the services collection; returns (updated, unmatched) counts.
+    """
+    services_by_name = {s["name"]: s for s in services_collection.find()}
+
+    updated = 0
+    unmatched = 0
+    batch = []
+    cursor = appointments_collection.find(
+        {"service_id": {"$exists": False}},
+        {"service": 1}
+    )
+    for appt in cursor:
+        service = services_by_name.get(appt.get("service"))
+        if not service:
+            unmatched += 1
+            continue
+        batch.append(UpdateOne(
+            {"_id": appt["_id"], "service_id": {"$exists": False}},
+            {"$set": service_snapshot(service)}
+        ))
+        if len(batch) >= batch_size:
+            updated += appointments_collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+
+    if batch:
+        updated += appointments_collection.bulk_write(batch, ordered=False).modified_count
+
+    bump_data_versions("appointment", "payment")
+    return updated, unmatched
+
+
+@app.cli.command("backfill-service-snapshots")
+def backfill_service_snapshots_command():
+    """Migration: snapshot service prices onto existing appointments."""
+    updated, unmatched = backfill_service_snapshots()
+    print(f"✅ Snapshotted {updated} appointments ({unmatched} had no matching service)")
+
+
 
 # -----------------------------
 # CALENDAR EVENTS
 # -----------------------------
 
 @app.route("/api/calendar")
+@conditional_get("calendar")
 def get_calendar_events():
     events = []
 
-    slots = list(calendar_collection.find())
+    slots = list(calendar_collection.find({}, {"date": 1, "time": 1, "status": 1}))
     for s in slots:
         color = "#28a745" if s["status"] == "available" else "#dc3545"
         events.append({
@@ -1957,40 +4169,127 @@ def get_calendar_events():
     return jsonify(events)
 
 @app.route("/api/blocked-slots")
+@conditional_get("block")
+@cached_view("block", public=True)
 def blocked_slots():
-    events = []
-    blocks = blocked_collection.find()
+    """
+    Blocked time for the calendar's visible window. FullCalendar sends
+    ?start=...&end=... (end exclusive); recurring blocks are expanded per date.
+    """
+    today = date.today()
+    try:
+        first = datetime.strptime(request.args["start"][:10], "%Y-%m-%d").date()
+        last = datetime.strptime(request.args["end"][:10], "%Y-%m-%d").date() - timedelta(days=1)
+    except (KeyError, ValueError):
+        first, last = today - timedelta(days=7), today + timedelta(days=35)
+    last = min(max(last, first), first + timedelta(days=BLOCK_FEED_MAX_DAYS))
+
+    since = parse_since()
+    if since is not None:
+        # Delta: changed blocks are dropped client-side and re-sent for this window
+        entries, latest, reset = changes_since(["block"], since)
+        if reset:
+            return jsonify({"seq": latest, "reset": True, "events": [], "removed_blocks": []})
+        block_ids = list({ObjectId(e["entity_id"]) for e in entries})
+        occurrences = expand_blocks(list(blocked_collection.find({"_id": {"$in": block_ids}})), first, last)
+        return jsonify({
+            "seq": latest,
+            "reset": False,
+            "events": block_events(occurrences),
+            "removed_blocks": [str(i) for i in block_ids]
+        })
 
+    seq = current_sequence("changes")
+    occurrences = get_block_occurrences(first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d"))
 
-    for b in blocks:
-        start = f"{b['date']}T{b['start']}"
-        end = f"{b['date']}T{b['end']}"
+    response = jsonify(block_events(occurrences))
+    response.headers["X-Change-Seq"] = str(seq)
+    return response
 
 
-        events.append({
-            "id": str(b['_id']),
-            "title": "Blocked",
-            "start": start,
-            "end": end,
-            "color": "#6c757d", # gray
-            "editable": False
-        })
+def block_events(occurrences):
+    """Calendar events for expanded block occurrences."""
+    events = []
+    for day, intervals in sorted(occurrences.items()):
+        for start, end, b in intervals:
+            recurring = "recurrence" in b
+            events.append({
+                # Each occurrence of a recurring block needs its own id
+                "id": f"{b['_id']}_{day}" if recurring else str(b['_id']),
+                "title": "Blocked",
+                "start": f"{day}T{from_minutes(start)}",
+                "end": f"{day}T{from_minutes(end)}",
+                "color": "#6c757d", # gray
+                "editable": False,
+                "extendedProps": {
+                    "isBlocked": True,
+                    "reason": b.get("reason"),
+                    "recurring": recurring,
+                    "blockId": str(b['_id'])
+                }
+            })
 
+    return events
+
+def parse_block_repeat(repeat, first_date):
+    """Validated recurrence rule for a block starting on first_date; raises ValueError."""
+    if not isinstance(repeat, dict) or repeat.get("freq") not in ("weekly", "daily"):
+        raise ValueError("freq must be weekly or daily")
+
+    until = repeat.get("until") or None
+    if until is not None:
+        if not isinstance(until, str):
+            raise ValueError("until must be a YYYY-MM-DD date")
+        datetime.strptime(until, "%Y-%m-%d")
+        if until < first_date:
+            raise ValueError("until must not be before the block's date")
+
+    recurrence = {"freq": repeat["freq"], "from": first_date, "until": until, "except": []}
+    if repeat["freq"] == "weekly":
+        weekdays = repeat.get("weekdays") or [datetime.strptime(first_date, "%Y-%m-%d").weekday()]
+        if not isinstance(weekdays, list) or not all(
+            isinstance(d, int) and not isinstance(d, bool) and 0 <= d <= 6 for d in weekdays
+        ):
+            raise ValueError("weekdays must be a list of integers 0-6 (Monday = 0)")
+        recurrence["weekdays"] = sorted(set(weekdays))
+    return recurrence
 
-    return jsonify(events)
 
 @app.route("/api/block", methods=["POST"])
 def create_block():
+    """
+    Block a time range on a date. Optionally repeat it:
+    "repeat": {"freq": "weekly" | "daily", "until": "YYYY-MM-DD", "weekdays": [0-6]}
+    """
     data = request.json
 
+    try:
+        if to_minutes(data["start"]) >= to_minutes(data["end"]):
+            raise ValueError("start must be before end")
+        datetime.strptime(data["date"], "%Y-%m-%d")
+    except (KeyError, TypeError, ValueError) as e:
+        return {"success": False, "error": f"Invalid block: {e}"}, 400
 
-    blocked_collection.insert_one({
+    block = {
         "date": data["date"],
         "start": data["start"],
         "end": data["end"],
         "reason": data.get("reason", "Blocked")
-    })
+    }
+
+    repeat = data.get("repeat")
+    if repeat:
+        try:
+            recurrence = parse_block_repeat(repeat, data["date"])
+        except (TypeError, ValueError) as e:
+            return {"success": False, "error": f"Invalid repeat: {e}"}, 400
+        block["recurrence"] = recurrence
+        # Recurring blocks are found through their rule, not a single date
+        del block["date"]
 
+    block_id = blocked_collection.insert_one(block).inserted_id
+    invalidate_block_cache()
+    record_changes("block", [block_id], "create")
 
     return {"success": True}
 
@@ -1998,45 +4297,104 @@ def create_block():
 def add_calendar_slot():
     data = request.json
 
-    calendar_collection.insert_one({
+    slot_id = calendar_collection.insert_one({
         "date": data["date"],
         "time": data["time"],
         "status": "available",
         "appointment_id": None
-    })
+    }).inserted_id
+    record_changes("calendar", [slot_id], "create")
     return jsonify({"success": True})
 
 @app.route("/api/calendar/delete", methods=["POST"])
 def delete_calendar_slot():
     data = request.json
     calendar_collection.delete_one({"_id": ObjectId(data["id"])})
+    record_changes("calendar", [data["id"]], "delete")
     return jsonify({"success": True})
 
+CALENDAR_EVENT_PROJECTION = {"date": 1, "time": 1, "fullname": 1, "service": 1}
+
+
+def appointment_event(a):
+    return {
+        "id": str(a['_id']),
+        "title": f"{a['fullname']} - {a['service']}",
+        "start": f"{a['date']}T{a['time']}",
+        "color": "#dc3545" # red = booked
+    }
+
+
 @app.route("/api/calendar-events")
+@conditional_get("appointment", "payment")
+@cached_view("appointment", "payment", public=True)
 def calendar_events():
-    events = []
-    appointments = appointments_collection.find()
+    """
+    All appointments as calendar events. With ?since=<seq> only the
+    appointments changed after that sequence number are returned.
+    """
+    since = parse_since()
+    if since is not None:
+        entries, latest, reset = changes_since(["appointment", "payment"], since)
+        if reset:
+            return jsonify({"seq": latest, "reset": True, "events": [], "removed": []})
+
+        ids = list({ObjectId(e["entity_id"]) for e in entries})
+        current = {
+            a["_id"]: a
+            for a in appointments_collection.find({"_id": {"$in": ids}}, CALENDAR_EVENT_PROJECTION)
+        }
+        return jsonify({
+            "seq": latest,
+            "reset": False,
+            "events": [appointment_event(current[i]) for i in ids if i in current],
+            "removed": [str(i) for i in ids if i not in current]
+        })
 
+    # Read the sequence first so a change during the full load is replayed, not lost
+    seq = current_sequence("changes")
+    events = [appointment_event(a) for a in appointments_collection.find({}, CALENDAR_EVENT_PROJECTION)]
 
-    for a in appointments:
-        start = f"{a['date']}T{a['time']}"
-        events.append({
-            "id": str(a['_id']),
-            "title": f"{a['fullname']} - {a['service']}",
-            "start": start,
-            "color": "#dc3545" # red = booked
-        })
+    response = jsonify(events)
+    response.headers["X-Change-Seq"] = str(seq)
+    return response
+
+@app.route("/api/earliest-slots")
+def earliest_slots():
+    """
+    Next open slots across the coming weeks.
+    Query: ?service_id=...&count=5&horizon=45 (days, max 60)
+    """
+    try:
+        count = max(1, min(int(request.args.get("count", 5)), 20))
+        horizon = max(1, min(int(request.args.get("horizon", 45)), 60))
+    except ValueError:
+        return jsonify({"success": False, "error": "count and horizon must be numbers"}), 400
 
+    duration = get_service_duration(request.args.get("service_id"))
+    slots = find_earliest_slots(duration, count, horizon)
+    return jsonify([
+        {"date": day, "time": time_24h, "time_display": to_ampm(time_24h)}
+        for day, time_24h in slots
+    ])
 
-    return jsonify(events)
 
 @app.route("/api/free-times/<date>")
+@conditional_get("appointment", "payment", "block", "schedule", "service")
+@cached_view("appointment", "payment", "block", "schedule", "service", public=True)
 def free_times(date):
     """
     API endpoint that returns available time slots for a given date.
     Calls the helper function to do the actual work.
+    Pass ?service_id= to only get times where that service's duration fits.
     """
-    free_times_list = get_free_times_for_date(date)
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid date, expected YYYY-MM-DD"}), 400
+
+    duration = get_service_duration(request.args.get("service_id"))
+    free_times_list = get_free_times_for_date(date, duration)
     return jsonify(free_times_list)
 
 
@@ -2044,8 +4402,7 @@ def free_times(date):
 def api_unblock():
     data = request.get_json()
     event_id = data.get("eventId")
-    result = blocked_collection.delete_one({"_id": ObjectId(event_id)})
-    if result.deleted_count == 0:
+    if not remove_block(event_id, data.get("scope", "occurrence")):
         return jsonify({"success": False, "message": "Event not found"})
     return jsonify({"success": True, "message": "Blocked slot removed"})
 
@@ -2055,9 +4412,7 @@ def unblock_slot_browser(slot_id):
     Remove a blocked slot by its ID via a browser link.
     Example: /unblock/64b8f0a2e1f3c9d123456789
     """
-    result = blocked_collection.delete_one({"_id": ObjectId(slot_id)})
-
-    if result.deleted_count == 0:
+    if not remove_block(slot_id):
         flash("Blocked slot not found.", "danger")
     else:
         flash("Blocked slot removed successfully.", "success")
@@ -2092,43 +4447,164 @@ def initialize_facebook_setup():
     except Exception as e:
         print(f"❌ Error setting up persistent menu on startup: {e}")
 
+# -----------------------------
+# APPOINTMENT ARCHIVE (hot/cold)
+# -----------------------------
+# Closed appointments older than ARCHIVE_AFTER_DAYS are copied in full to
+# appointments_archive. The hot collection keeps only a thin summary
+# (archived: True) so list views stay small. History and reports read the
+# archive when their date range reaches back that far.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVABLE_STATUSES = ["done", "cancelled", "declined"]
+ARCHIVE_BATCH_SIZE = 500
+
+# Fields dropped from the hot summary; they live only in the archive. Everything
+# else (version, created_at, claim fields, ...) stays so lifecycle guards and
+# queue queries keep working on archived rows.
+ARCHIVE_HEAVY_FIELDS = (
+    "payment_proof", "payment_proof_file_id", "payment_proof_thumb_id",
+    "payment_proof_content_type", "payment_proof_etag", "payment_proof_ingested_at",
+    "decline_reason"
+)
+
+
+def archive_cutoff_date(older_than_days=None):
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    return (date.today() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def _export_archive_month_files(docs, export_dir):
+    """Append archived documents to gzip-compressed JSON-lines files per month."""
+    by_month = {}
+    for doc in docs:
+        by_month.setdefault(doc["date"][:7], []).append(doc)
+
+    os.makedirs(export_dir, exist_ok=True)
+    for month, month_docs in by_month.items():
+        path = os.path.join(export_dir, f"appointments-{month}.jsonl.gz")
+        with gzip.open(path, "at", encoding="utf-8") as fh:
+            for doc in month_docs:
+                fh.write(json_util.dumps(doc) + "\n")
+
+
+def archive_old_appointments(older_than_days=None, export_dir=None):
+    """
+    Move closed appointments older than the cutoff into the archive and
+    leave thin summaries behind. Safe to re-run: archive writes are upserts
+    and only documents not yet archived are picked up. Returns the count.
+    """
+    cutoff = archive_cutoff_date(older_than_days)
+    query = {
+        "status": {"$in": ARCHIVABLE_STATUSES},
+        "date": {"$lt": cutoff},
+        "archived": {"$ne": True}
+    }
+
+    archived = 0
+    while True:
+        batch = list(appointments_collection.find(query).limit(ARCHIVE_BATCH_SIZE))
+        if not batch:
+            break
+
+        now = datetime.now()
+        appointments_archive_collection.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, {**doc, "archived_at": now}, upsert=True) for doc in batch],
+            ordered=False
+        )
+        if export_dir:
+            _export_archive_month_files(batch, export_dir)
+
+        # Thin each hot document down to its summary, unless it changed meanwhile
+        result = appointments_collection.bulk_write([
+            UpdateOne(
+                {"_id": doc["_id"], "status": doc["status"], "archived": {"$ne": True}},
+                {
+                    "$set": {"archived": True, "archived_at": now},
+                    "$unset": {f: "" for f in ARCHIVE_HEAVY_FIELDS}
+                }
+            )
+            for doc in batch
+        ], ordered=False)
+        archived += result.matched_count
+
+        if result.matched_count < len(batch):
+            # These changed before they could be thinned; drop their archive copies
+            kept = appointments_collection.find(
+                {"_id": {"$in": [doc["_id"] for doc in batch]}, "archived": {"$ne": True}}, {"_id": 1}
+            )
+            appointments_archive_collection.delete_many({"_id": {"$in": [doc["_id"] for doc in kept]}})
+
+    if archived:
+        bump_data_versions("appointment", "payment")
+    return archived
+
+
+def find_appointments_in_range(query, first=None, last=None, projection=None):
+    """
+    Appointments matching `query` between two 'YYYY-MM-DD' dates (either may
+    be None for an open range), read from the hot collection and, when the
+    range reaches past the archive cutoff, from the archive as well.
+    """
+    date_filter = {}
+    if first:
+        date_filter["$gte"] = first
+    if last:
+        date_filter["$lte"] = last
+    if date_filter:
+        query = {**query, "date": date_filter}
+
+    results = list(appointments_collection.find({**query, "archived": {"$ne": True}}, projection))
+
+    # Nothing newer than the cutoff has ever been archived
+    if first is None or first < archive_cutoff_date():
+        # An interrupted archive run can leave a copy of a document that is still hot
+        hot_ids = {doc["_id"] for doc in results}
+        results.extend(
+            doc for doc in appointments_archive_collection.find(query, projection)
+            if doc["_id"] not in hot_ids
+        )
+
+    return results
+
+
+@app.cli.command("archive-appointments")
+@click.option("--days", type=int, default=None, help="Archive closed appointments older than this many days.")
+@click.option("--export-dir", default=None, help="Also append them to gzip JSON-lines files per month here.")
+def archive_appointments_command(days, export_dir):
+    """Move old done/cancelled/declined appointments to appointments_archive."""
+    count = archive_old_appointments(days, export_dir)
+    print(f"✅ Archived {count} appointments (cutoff {archive_cutoff_date(days)})")
+
+
 # -----------------------------
 # REPORTS and PATIENT HISTORY
 # -----------------------------
 
 @app.route('/reports')
+@cached_view("appointment", "payment")
 def reports():
-    # Fetch all appointments with payment information
-    payments_cursor = db.appointments.find({"payment_status": {"$exists": True}})
+    # Fetch appointments with payment information, optionally for ?from=&to= dates
+    payments_cursor = find_appointments_in_range(
+        {"payment_status": {"$exists": True}},
+        request.args.get("from"),
+        request.args.get("to")
+    )
     payments = []
     
     for payment in payments_cursor:
-        # Convert ObjectId to string for JavaScript
-        payment['_id'] = str(payment['_id'])
-        
         # Ensure downpayment exists and is a number
         downpayment = float(payment.get('downpayment', 0))
         payment['downpayment'] = downpayment
         
-        # Get service_price from the services collection
-        # Your services collection uses 'price' field, not 'service_price'
+        # Service price snapshot taken when the appointment was booked
         service_price = None
-        
-        # Try to get the service price from the services collection
-        if 'service' in payment and payment['service']:
-            # Look up service by name
-            service_data = services_collection.find_one({"name": payment['service']})
-            if service_data and 'price' in service_data:
-                service_price = float(service_data['price'])
+        if payment.get('service_price') is not None:
+            service_price = float(payment['service_price'])
         
         # Fallback: check if price is stored directly in the appointment
         if service_price is None and 'price' in payment:
             service_price = float(payment['price'])
         
-        # Fallback: check if service_price is stored in appointment
-        if service_price is None and 'service_price' in payment:
-            service_price = float(payment['service_price'])
-        
         # Last resort: if still not found, use downpayment (means fully paid)
         if service_price is None or service_price == 0:
             service_price = downpayment
@@ -2155,14 +4631,16 @@ def reports():
 
 
 @app.route('/patient-history')
+@cached_view("appointment", "payment")
 def patient_history():
-    appts = list(appointments_collection.find())
+    # Full history, including appointments that were moved to the archive
+    appts = find_appointments_in_range(
+        {}, request.args.get("from"), request.args.get("to"), APPOINTMENT_LIST_PROJECTION
+    )
     today = datetime.now().strftime('%Y-%m-%d')
     
     # Process appointments similar to appointments() route
     for a in appts:
-        a["_id"] = str(a["_id"])
-        
         # Convert single service string to services array
         if "service" in a:
             a["services"] = [{"name": a["service"]}]
@@ -2175,12 +4653,74 @@ def patient_history():
 
 
 
+# -----------------------------
+# MEMORY TRACKING
+# -----------------------------
+# Size gauges for process-level state are always available. MEMORY_TRACE_FRAMES
+# (traceback depth, 0 = off) switches on tracemalloc with a snapshot every
+# MEMORY_SNAPSHOT_INTERVAL seconds, so /api/memory can list the allocation
+# sites that grew since the previous snapshot. /metrics exposes the gauges to
+# Prometheus: admins can open it, scrapers send "Authorization: Bearer <METRICS_TOKEN>".
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "0"))
+MEMORY_SNAPSHOT_INTERVAL = int(os.getenv("MEMORY_SNAPSHOT_INTERVAL", "300"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+memory_tracker = MemoryTracker(interval=MEMORY_SNAPSHOT_INTERVAL, frames=max(MEMORY_TRACE_FRAMES, 1))
+memory_tracker.register("user_state", user_state)
+memory_tracker.register("page_cache", _page_cache, _page_cache_guard)
+memory_tracker.register("block_cache", _block_cache, _block_cache_lock)
+memory_tracker.register("schedule_cache", _schedule_cache, _schedule_cache_lock)
+memory_tracker.register("transcript_buffer", transcript_buffer.items, transcript_buffer.lock)
+if MEMORY_TRACE_FRAMES > 0:
+    memory_tracker.start()
+
+
+@app.route("/api/memory")
+def memory_report():
+    """Gauges and top growing allocation sites; ?since=baseline compares with the first snapshot."""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    since = "baseline" if request.args.get("since") == "baseline" else "previous"
+    try:
+        limit = max(1, min(int(request.args.get("limit", 25)), 200))
+    except ValueError:
+        limit = 25
+    return jsonify({"success": True, "memory": memory_tracker.report(since, limit)})
+
+
+@app.route("/api/memory/snapshot", methods=["POST"])
+def memory_snapshot():
+    """Take a snapshot now, e.g. right before and after a suspect operation."""
+    denied = admin_only()
+    if denied:
+        return denied
+
+    if not memory_tracker.tracing:
+        return jsonify({"success": False, "error": "Tracing is off (set MEMORY_TRACE_FRAMES)"}), 409
+    memory_tracker.take_snapshot()
+    return jsonify({"success": True, "top_growth": memory_tracker.top_growth()})
+
+
+@app.route("/metrics")
+def metrics():
+    bearer = request.headers.get("Authorization", "")
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(bearer, f"Bearer {METRICS_TOKEN}")
+    if not token_ok and session.get("role") != "admin":
+        return "Forbidden", 403
+    return Response(memory_tracker.metrics_text(), mimetype="text/plain; version=0.0.4")
+
+
 # -----------------------------
 # RUN SERVER
 # -----------------------------
 if __name__ == "__main__":
     # Initialize Facebook menu on startup
     initialize_facebook_setup()
+
+    # Copy any payment proofs that are still only on the Messenger CDN
+    queue_missing_payment_proofs()
     
     # Run the app
     app.run(debug=True)
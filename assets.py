@@ -0,0 +1,153 @@
+"""
+Static asset build.
+
+`flask build-assets` bundles and minifies the CSS/JS the admin templates
+load, copies images and fonts, and writes every output under static/dist
+with a content hash in its name plus .gz/.br siblings. manifest.json maps
+source names to built names; since a built file never changes, it can be
+cached by browsers for a year without revalidation.
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:  # optional: only .gz siblings are written
+    brotli = None
+
+DIST_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+
+# bundle name -> source files under static/, in load order
+BUNDLES = {
+    "admin.css": ["assets/css/cs-skin-elastic.css", "assets/css/style.css"],
+    # The dashboard has always loaded them the other way round
+    "dashboard.css": ["assets/css/style.css", "assets/css/cs-skin-elastic.css"],
+    "main.js": ["assets/js/main.js"],
+    "live.js": ["assets/js/live-changes.js"],
+}
+
+# Copied with fingerprints so templates and CSS url()s can reference them
+FINGERPRINT_DIRS = ["assets/images", "assets/fonts"]
+FINGERPRINT_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".eot", ".ttf", ".woff", ".woff2"}
+
+# Not worth compressing
+PRECOMPRESS_EXTENSIONS = {".css", ".js", ".svg", ".eot", ".ttf"}
+PRECOMPRESS_MIN_BYTES = 512
+
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+CSS_IMPORT_RE = re.compile(r"@import\s+[^;]+;")
+
+
+def minify_css(css):
+    """
+    Strip comments and insignificant whitespace. Strings are not parsed, which
+    is fine for the clinic's stylesheets (no separators inside quoted values).
+    """
+    css = re.sub(r"/\*(?!!).*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def fingerprinted_name(path, content):
+    """assets/css/style.css -> assets/css/style.<hash>.css"""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    root, ext = posixpath.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+def write_output(static_folder, name, content):
+    """Write a built file (and compressed siblings) under static/dist."""
+    path = os.path.join(static_folder, DIST_DIR, *name.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(content)
+
+    if posixpath.splitext(name)[1] in PRECOMPRESS_EXTENSIONS and len(content) >= PRECOMPRESS_MIN_BYTES:
+        # mtime=0 keeps the .gz output identical across builds
+        with open(path + ".gz", "wb") as fh:
+            fh.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", "wb") as fh:
+                fh.write(brotli.compress(content, quality=11))
+
+
+def rewrite_css_urls(css, source, bundle_name, files):
+    """Point relative url()s of a bundled stylesheet at fingerprinted files."""
+    source_dir = posixpath.dirname(source)
+    bundle_dir = posixpath.dirname(bundle_name)
+
+    def replace(match):
+        url = match.group(2)
+        if re.match(r"^(?:[a-z]+:|/|#)", url):
+            return match.group(0)
+        # Keep cache-busting queries and fragments such as "?#iefix"
+        path, suffix = re.match(r"([^?#]*)(.*)", url).groups()
+        target = posixpath.normpath(posixpath.join(source_dir, path))
+        if target not in files:
+            return match.group(0)
+        relative = posixpath.relpath(files[target], bundle_dir or ".")
+        return f"url('{relative}{suffix}')"
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+def build_assets(static_folder):
+    """Build static/dist and its manifest. Returns the manifest."""
+    files = {}
+    for directory in FINGERPRINT_DIRS:
+        for root, _, names in os.walk(os.path.join(static_folder, *directory.split("/"))):
+            for name in sorted(names):
+                if posixpath.splitext(name)[1].lower() not in FINGERPRINT_EXTENSIONS:
+                    continue
+                full = os.path.join(root, name)
+                source = os.path.relpath(full, static_folder).replace(os.sep, "/")
+                with open(full, "rb") as fh:
+                    content = fh.read()
+                files[source] = fingerprinted_name(source, content)
+                write_output(static_folder, files[source], content)
+
+    bundles = {}
+    for bundle, sources in BUNDLES.items():
+        bundle_name = f"bundles/{bundle}"
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_folder, *source.split("/")), encoding="utf-8") as fh:
+                text = fh.read()
+            if bundle.endswith(".css"):
+                text = rewrite_css_urls(text, source, bundle_name, files)
+            parts.append(text)
+
+        if bundle.endswith(".css"):
+            text = "\n".join(parts)
+            # @import is only valid at the top of a stylesheet
+            imports = list(dict.fromkeys(CSS_IMPORT_RE.findall(text)))
+            text = "".join(imports) + minify_css(CSS_IMPORT_RE.sub("", text))
+        else:
+            # Scripts are concatenated as-is; each source ends its own statements
+            text = ";\n".join(parts)
+
+        content = text.encode("utf-8")
+        bundles[bundle] = fingerprinted_name(bundle_name, content)
+        write_output(static_folder, bundles[bundle], content)
+
+    manifest = {"files": files, "bundles": bundles}
+    with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    """The last build's manifest, or an empty one if assets were never built."""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return {"files": {}, "bundles": {}}
+    return {"files": manifest.get("files", {}), "bundles": manifest.get("bundles", {})}
@@ -0,0 +1,10 @@
+"""
+Benchmarks for the clinic app.
+
+    python -m bench.run --scales 1000 100000 1000000 --out bench-results.json
+
+Seeds a MongoDB database (MONGO_URI, default a local server; DB_NAME must
+contain "bench") with synthetic clinic data at each scale, then times the
+hot paths against it. The Messenger bot talks to a local Graph API
+stand-in, so nothing is sent to Facebook.
+"""
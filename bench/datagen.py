@@ -0,0 +1,220 @@
+"""
+Synthetic clinic data: services, years of appointment history, blocked
+slots, Messenger users and their messages. Everything is derived from a
+seed, so two runs at the same scale produce the same database.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+
+SERVICES = [
+    # name, price, downpayment, duration (minutes)
+    ("Consultation", 500, 200, 30),
+    ("Oral Prophylaxis", 1200, 300, 60),
+    ("Tooth Extraction", 1500, 500, 60),
+    ("Tooth Filling", 1300, 400, 60),
+    ("Root Canal Treatment", 8000, 2000, 120),
+    ("Teeth Whitening", 6000, 1500, 90),
+    ("Dentures", 12000, 3000, 60),
+    ("Braces Adjustment", 1000, 300, 30),
+    ("Braces Installation", 35000, 5000, 120),
+    ("Dental X-Ray", 800, 200, 30),
+    ("Crown", 9000, 2500, 90),
+    ("Veneers", 15000, 4000, 120),
+]
+
+FIRST_NAMES = ["Maria", "Jose", "Ana", "Juan", "Rosa", "Mark", "Grace", "Paolo", "Liza", "Ramon",
+               "Joy", "Carlo", "Aileen", "Noel", "Kristine", "Dennis", "Mae", "Arnel", "Cherry", "Jun"]
+LAST_NAMES = ["Santos", "Reyes", "Cruz", "Bautista", "Garcia", "Mendoza", "Torres", "Flores",
+              "Villanueva", "Ramos", "Aquino", "Castillo", "Rivera", "Dela Cruz", "Navarro"]
+PAYMENT_METHODS = ["GCASH", "PAYMAYA", "COUNTER"]
+OPENING_HOURS = [9, 10, 11, 13, 14, 15, 16]
+
+# Bookings more than this many days ahead are rare; the future stays bounded
+# while history grows with the scale
+FUTURE_DAYS = 60
+FUTURE_PER_DAY = 6
+
+BATCH_SIZE = 10000
+
+
+def generate_services():
+    return [
+        {"name": name, "price": float(price), "downpayment": float(downpayment), "duration": duration}
+        for name, price, downpayment, duration in SERVICES
+    ]
+
+
+def sender_id(n):
+    # Page-scoped ids are 16-17 digit numbers
+    return str(7000000000000000 + n)
+
+
+def _appointment(rng, services, day, status, payment_status, patients):
+    service = rng.choice(services)
+    patient = rng.randrange(patients)
+    rng_name = random.Random(patient)
+    booked = datetime.combine(day, time(8)) - timedelta(days=rng.randint(1, 20), minutes=rng.randint(0, 600))
+    appt = {
+        "fullname": f"{rng_name.choice(FIRST_NAMES)} {rng_name.choice(LAST_NAMES)}",
+        "user_id": sender_id(patient),
+        "service": service["name"],
+        "service_id": service["_id"],
+        "service_price": service["price"],
+        "service_downpayment": service["downpayment"],
+        "service_duration": service["duration"],
+        "date": day.strftime("%Y-%m-%d"),
+        "time": f"{rng.choice(OPENING_HOURS):02d}:00",
+        "downpayment": service["downpayment"],
+        "payment_method": rng.choice(PAYMENT_METHODS),
+        "payment_proof": f"https://scontent.xx.fbcdn.net/v/t1.15752-9/{rng.getrandbits(64):x}_n.jpg",
+        "payment_status": payment_status,
+        "status": status,
+        "version": 1 if status != "pending" else 0,
+        "created_at": booked
+    }
+    if status == "confirmed" or status == "done":
+        appt["approved_at"] = booked + timedelta(hours=2)
+    if status == "done":
+        appt["completed_at"] = datetime.combine(day, time(17))
+    if status == "cancelled":
+        appt["cancelled_at"] = booked + timedelta(days=1)
+    if status == "declined":
+        appt["declined_at"] = booked + timedelta(hours=3)
+        appt["decline_reason"] = "Proof of payment is unclear"
+    return appt
+
+
+def generate_appointments(count, services, today=None, years=3, patients=None, seed=1):
+    """Yield `count` appointments: history over `years` years plus the next weeks."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    patients = patients or max(50, count // 4)
+    future = min(count // 20, FUTURE_DAYS * FUTURE_PER_DAY)
+    past_days = years * 365
+
+    for i in range(count):
+        if i < future:
+            day = today + timedelta(days=rng.randint(0, FUTURE_DAYS))
+            status, payment_status = rng.choices(
+                [("confirmed", "approved"), ("pending", "pending"), ("rescheduled", "approved"),
+                 ("cancelled", "approved")],
+                weights=[60, 25, 10, 5]
+            )[0]
+        else:
+            day = today - timedelta(days=rng.randint(1, past_days))
+            status, payment_status = rng.choices(
+                [("done", "approved"), ("cancelled", "approved"), ("declined", "declined"),
+                 ("confirmed", "approved")],
+                weights=[80, 10, 5, 5]
+            )[0]
+        yield _appointment(rng, services, day, status, payment_status, patients)
+
+
+def generate_blocks(today=None, seed=1):
+    """A weekly lunch-hour block, a few one-off holidays and closed afternoons."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    blocks = [{
+        "start": "12:00", "end": "13:00", "reason": "Lunch",
+        "recurrence": {"freq": "weekly", "weekdays": [0, 1, 2, 3, 4, 5],
+                       "from": (today - timedelta(days=365)).strftime("%Y-%m-%d"),
+                       "until": None, "except": []}
+    }]
+    for _ in range(20):
+        day = today + timedelta(days=rng.randint(-180, 90))
+        start = rng.choice(["09:00", "13:00"])
+        blocks.append({
+            "date": day.strftime("%Y-%m-%d"),
+            "start": start,
+            "end": "17:00" if start == "13:00" else "12:00",
+            "reason": rng.choice(["Holiday", "Seminar", "Dentist unavailable"])
+        })
+    return blocks
+
+
+def generate_messenger_users(count):
+    return [
+        {
+            "sender_id": sender_id(n),
+            "fullname": "Messenger User",
+            "state": {"step": None, "service_id": None, "service_name": None, "date": None, "time": None},
+            "created_at": datetime(2024, 1, 1) + timedelta(minutes=n)
+        }
+        for n in range(count)
+    ]
+
+
+def generate_messages(users, per_user=8, seed=1):
+    """Yield a short back-and-forth conversation per Messenger user."""
+    rng = random.Random(seed)
+    texts_in = ["hi", "book", "How much is cleaning?", "2025-12-20", "10:00 AM", "Thank you!"]
+    texts_out = ["Please choose an option below 👇", "⏰ Select from these available times:",
+                 "✅ Proof received!", "📝 Please type your full name for the appointment:"]
+    for user in users:
+        at = user["created_at"]
+        for n in range(per_user):
+            at += timedelta(minutes=rng.randint(1, 180))
+            incoming = n % 2 == 0
+            yield {
+                "sender_id": user["sender_id"],
+                "direction": "in" if incoming else "out",
+                "text": rng.choice(texts_in if incoming else texts_out),
+                "timestamp": at,
+                "read": not incoming or rng.random() < 0.9
+            }
+
+
+def generate_conversations(users, per_user=8, seed=1):
+    """The per-sender summaries the app keeps next to generate_messages' output."""
+    conversations = {}
+    for message in generate_messages(users, per_user, seed=seed):
+        c = conversations.setdefault(message["sender_id"], {
+            "_id": message["sender_id"], "message_count": 0, "unread": 0
+        })
+        c.update(last_text=message["text"], last_direction=message["direction"], last_at=message["timestamp"])
+        c["message_count"] += 1
+        c["unread"] += message["direction"] == "in" and not message["read"]
+    return list(conversations.values())
+
+
+def insert_batched(collection, documents):
+    """insert_many in BATCH_SIZE chunks so a million documents never sit in memory."""
+    total = 0
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            total += len(collection.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        total += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return total
+
+
+def seed_database(db, appointments, messenger_users=None, messages_per_user=8, years=3, seed=1):
+    """
+    Replace the clinic collections in `db` with synthetic data.
+    Returns the number of documents inserted per collection.
+    """
+    messenger_users = messenger_users if messenger_users is not None else max(50, appointments // 20)
+    for name in ("services", "appointments", "appointments_archive", "blocked_slots", "schedules",
+                 "messenger_users", "messages", "conversations", "changes", "counters", "calendar"):
+        db[name].drop()
+
+    services = generate_services()
+    db["services"].insert_many(services)  # sets _id on each service
+
+    users = generate_messenger_users(messenger_users)
+    conversations = generate_conversations(users, messages_per_user, seed=seed)
+    db["counters"].insert_one({"_id": "changes", "seq": 0,
+                               "unread_messages": sum(c["unread"] for c in conversations)})
+    return {
+        "services": len(services),
+        "appointments": insert_batched(
+            db["appointments"], generate_appointments(appointments, services, years=years, seed=seed)
+        ),
+        "blocked_slots": insert_batched(db["blocked_slots"], generate_blocks(seed=seed)),
+        "messenger_users": insert_batched(db["messenger_users"], users),
+        "messages": insert_batched(db["messages"], generate_messages(users, messages_per_user, seed=seed)),
+        "conversations": insert_batched(db["conversations"], conversations),
+    }
@@ -0,0 +1,146 @@
+"""
+Local stand-in for the Graph API endpoints the bot calls.
+
+Accepts POST /me/messages and /me/messenger_profile, answers like Facebook
+does, counts calls per recipient and keeps the last message sent to each.
+Send calls can be given latency and a failure rate to mimic a slow or
+flaky Graph API.
+GET of any other path returns a small PNG, so payment-proof URLs pointed
+here can be downloaded and thumbnailed.
+"""
+import base64
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1x1 transparent PNG
+PROOF_IMAGE = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+
+class FakeGraphServer:
+    """Threaded HTTP server on 127.0.0.1; use as a context manager."""
+
+    def __init__(self, port=0, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self.sends = Counter()
+        self.last_messages = {}
+        self._lock = threading.Lock()
+        self._message_seq = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def proof_url(self, name):
+        return f"{self.url}/proofs/{name}.png"
+
+    def total_sends(self):
+        with self._lock:
+            return sum(self.sends.values())
+
+    def last_message(self, recipient_id):
+        with self._lock:
+            return self.last_messages.get(recipient_id) or {}
+
+    def last_quick_replies(self, recipient_id):
+        """Quick replies ({"title", "payload", ...}) of the last message sent to a recipient."""
+        return list(self.last_message(recipient_id).get("quick_replies", []))
+
+    def reset(self):
+        with self._lock:
+            self.sends.clear()
+            self.last_messages.clear()
+            self.errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def record_send(self, recipient_id, message):
+        with self._lock:
+            self.sends[recipient_id] += 1
+            self.last_messages[recipient_id] = message
+            self._message_seq += 1
+            return self._message_seq
+
+    def _delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                delay = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            time.sleep(max(0.0, delay) / 1000)
+
+    def _fails(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+    def respond(self, handler, payload):
+        """Status and JSON body for one POST."""
+        recipient_id = (payload.get("recipient") or {}).get("id")
+        if handler.path.split("?")[0].endswith("/me/messages"):
+            self._delay()
+            if self._fails():
+                # What Graph returns when it is having trouble
+                return 500, {"error": {"message": "An unexpected error has occurred.",
+                                       "type": "OAuthException", "code": 2, "is_transient": True}}
+            seq = self.record_send(recipient_id, payload.get("message") or {})
+            return 200, {"recipient_id": recipient_id, "message_id": f"m_fake{seq}"}
+        return 200, {"result": "success"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = {}
+                status, body = server.respond(self, payload)
+                self._send(status, json.dumps(body).encode(), "application/json")
+
+            def do_GET(self):
+                if "messenger_profile" in self.path:
+                    self._send(200, b'{"data": []}', "application/json")
+                else:
+                    self._send(200, PROOF_IMAGE, "image/png")
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
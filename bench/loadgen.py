@@ -0,0 +1,321 @@
+"""
+Load-test the Messenger webhook with many simultaneous booking conversations.
+
+    python -m bench.loadgen --conversations 200 --concurrency 20 --graph-latency 120
+
+Each simulated sender walks the whole booking flow the way Messenger
+delivers it to /webhook: a greeting, the BOOK_APPT and SERVICE_ postbacks,
+date quick replies (an earliest-opening SLOT_ or a typed date), a time, a
+typed name, the downpayment and payment-method quick replies and finally an
+image attachment as payment proof. The bot's replies go to a local Graph
+API stand-in with configurable latency and failure rate.
+
+By default the app is served in-process against a benchmark database
+(see bench.run). With --target the load goes to an already running
+instance instead; start it with GRAPH_API_URL pointing at --graph-port.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+from bench.datagen import sender_id
+from bench.fake_graph import FakeGraphServer
+
+PAGE_ID = "100000000000001"
+
+# Sender ids for load-test conversations, above the bench.run bot senders
+LOAD_SENDER_BASE = 2 * 10 ** 9
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=100, help="Booking conversations to run.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Conversations in flight at once.")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause between a sender's messages.")
+    parser.add_argument("--graph-latency", type=float, default=0, help="Graph API send latency (ms).")
+    parser.add_argument("--graph-jitter", type=float, default=0, help="+/- random latency added (ms).")
+    parser.add_argument("--graph-error-rate", type=float, default=0.0, help="Fraction of sends that fail.")
+    parser.add_argument("--graph-port", type=int, default=0, help="Port for the Graph stand-in (0 = any).")
+    parser.add_argument("--target", default=None,
+                        help="Base URL of a running app (default: serve the app in-process).")
+    parser.add_argument("--port", type=int, default=5055, help="Port for the in-process app.")
+    parser.add_argument("--seed-appointments", type=int, default=1000,
+                        help="In-process mode: appointments to seed first (0 keeps the existing data).")
+    parser.add_argument("--db", default=os.getenv("BENCH_DB_NAME", "jaylon_clinic_bench"))
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the senders' choices.")
+    parser.add_argument("--out", default=None, help="Also write the report as JSON here.")
+    return parser.parse_args(argv)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))], 2)
+
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(ordered, 0.50),
+        "p95_ms": percentile(ordered, 0.95),
+        "p99_ms": percentile(ordered, 0.99),
+        "max_ms": round(ordered[-1], 2) if ordered else None,
+        "mean_ms": round(statistics.fmean(ordered), 2) if ordered else None,
+    }
+
+
+# -----------------------------
+# Messenger webhook events
+# -----------------------------
+def webhook_body(sender, **event):
+    now = int(time.time() * 1000)
+    return {
+        "object": "page",
+        "entry": [{
+            "id": PAGE_ID,
+            "time": now,
+            "messaging": [{"sender": {"id": sender}, "recipient": {"id": PAGE_ID}, "timestamp": now, **event}]
+        }]
+    }
+
+
+def text_event(text):
+    return {"message": {"mid": f"m_{random.getrandbits(48):x}", "text": text}}
+
+
+def postback_event(payload, title=""):
+    return {"postback": {"title": title, "payload": payload}}
+
+
+def quick_reply_event(reply):
+    return {"message": {"mid": f"m_{random.getrandbits(48):x}", "text": reply["title"],
+                        "quick_reply": {"payload": reply["payload"]}}}
+
+
+def image_event(url):
+    return {"message": {"mid": f"m_{random.getrandbits(48):x}",
+                        "attachments": [{"type": "image", "payload": {"url": url}}]}}
+
+
+class Conversation:
+    """One sender booking an appointment through the webhook."""
+
+    def __init__(self, target, graph, sender, service_ids, rng, think_ms, stats):
+        self.target = target
+        self.graph = graph
+        self.sender = sender
+        self.service_ids = service_ids
+        self.rng = rng
+        self.think_ms = think_ms
+        self.stats = stats
+        self.http = requests.Session()
+
+    def post(self, step, event):
+        if self.think_ms:
+            time.sleep(self.think_ms / 1000)
+        body = webhook_body(self.sender, **event)
+        start = time.perf_counter()
+        response = self.http.post(f"{self.target}/webhook", json=body, timeout=60)
+        self.stats.record(step, (time.perf_counter() - start) * 1000, response.status_code)
+        if response.status_code != 200:
+            raise ConversationFailed(f"{step}: webhook answered {response.status_code}")
+
+    def reply(self, prefix):
+        """A quick reply from the bot's last message whose payload starts with prefix."""
+        for reply in self.graph.last_quick_replies(self.sender):
+            if reply.get("payload", "").startswith(prefix):
+                return reply
+        return None
+
+    def asked_for_name(self):
+        return "full name" in self.graph.last_message(self.sender).get("text", "")
+
+    def pick_date_and_time(self):
+        # Earliest-opening shortcut when the bot offered one, otherwise a typed date.
+        # A slot another sender just took sends the bot back to the date question.
+        slot = self.reply("SLOT_")
+        if slot and self.rng.random() < 0.5:
+            self.post("slot", quick_reply_event(slot))
+            if self.asked_for_name():
+                return
+
+        for _ in range(5):
+            day = date.today() + timedelta(days=self.rng.randint(2, 45))
+            self.post("pick_date", quick_reply_event({"title": "Pick a Date", "payload": "DATE_PICK"}))
+            self.post("typed_date", text_event(day.strftime("%Y-%m-%d")))
+            times = self.graph.last_quick_replies(self.sender)
+            if times and times[0].get("payload", "").startswith("TIME_"):
+                self.post("time", quick_reply_event(self.rng.choice(times)))
+                if self.asked_for_name():
+                    return
+        raise ConversationFailed("no open times offered")
+
+    def run(self):
+        self.post("greeting", text_event("hi"))
+        self.post("book", postback_event("BOOK_APPT", "🗓 Book Appointment"))
+        self.post("service", postback_event(f"SERVICE_{self.rng.choice(self.service_ids)}", "Book"))
+        self.pick_date_and_time()
+        self.post("name", text_event(f"Load Test {self.sender[-4:]}"))
+
+        for step, prefix in (("downpayment", "DP_YES"), ("payment_method", "PAYMENT_")):
+            reply = self.reply(prefix)
+            if not reply:
+                raise ConversationFailed(f"{step}: bot offered no {prefix} option")
+            self.post(step, quick_reply_event(reply))
+
+        self.post("proof", image_event(self.graph.proof_url(self.sender)))
+        if "Proof received" not in self.graph.last_message(self.sender).get("text", ""):
+            raise ConversationFailed("proof was not acknowledged")
+
+
+class ConversationFailed(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.by_step = defaultdict(list)
+        self.statuses = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.completed = 0
+
+    def record(self, step, ms, status):
+        with self._lock:
+            self.latencies.append(ms)
+            self.by_step[step].append(ms)
+            self.statuses[status] += 1
+
+    def finish(self, error=None):
+        with self._lock:
+            if error is None:
+                self.completed += 1
+            else:
+                self.failures[str(error)] += 1
+
+
+def serve_in_process(args, graph):
+    """Import the app against the bench database and serve it on a thread."""
+    from werkzeug.serving import make_server
+
+    from bench.datagen import seed_database
+    from bench.run import load_app
+
+    clinic = load_app(args.db, args.mongo_uri)
+    if args.seed_appointments:
+        print(f"Seeding {args.seed_appointments:,} appointments into {args.db}...")
+        seed_database(clinic.db, args.seed_appointments)
+        clinic.ensure_indexes()
+    clinic.GRAPH_API_URL = graph.url
+
+    server = make_server("127.0.0.1", args.port, clinic.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{args.port}"
+
+
+def run_load(args):
+    graph = FakeGraphServer(
+        port=args.graph_port, latency_ms=args.graph_latency, jitter_ms=args.graph_jitter,
+        error_rate=args.graph_error_rate, seed=args.seed
+    ).start()
+    server = None
+    try:
+        if args.target:
+            target = args.target.rstrip("/")
+            print(f"Graph stand-in listening on {graph.url} (the app must use GRAPH_API_URL={graph.url})")
+        else:
+            server, target = serve_in_process(args, graph)
+
+        service_ids = [s["_id"] for s in requests.get(f"{target}/get-services", timeout=30).json()]
+        if not service_ids:
+            raise SystemExit("The target has no services to book")
+
+        stats = Stats()
+        run_offset = int(time.time()) % 100000 * 1000
+        senders = [sender_id(LOAD_SENDER_BASE + run_offset + n) for n in range(args.conversations)]
+
+        def converse(n):
+            rng = random.Random(args.seed * 100003 + n)
+            conversation = Conversation(target, graph, senders[n], service_ids, rng, args.think_ms, stats)
+            try:
+                conversation.run()
+                stats.finish()
+            except (ConversationFailed, requests.RequestException) as e:
+                stats.finish(e)
+
+        print(f"Running {args.conversations} conversations, {args.concurrency} at a time against {target}...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(converse, range(args.conversations)))
+        elapsed = time.perf_counter() - start
+
+        sends = [graph.sends[s] for s in senders]
+        return {
+            "conversations": args.conversations,
+            "concurrency": args.concurrency,
+            "graph": {"latency_ms": args.graph_latency, "jitter_ms": args.graph_jitter,
+                      "error_rate": args.graph_error_rate, "failed_sends": graph.errors},
+            "elapsed_s": round(elapsed, 2),
+            "completed": stats.completed,
+            "failed": dict(stats.failures),
+            "webhook_requests": len(stats.latencies),
+            "throughput_rps": round(len(stats.latencies) / elapsed, 1),
+            "bookings_per_s": round(stats.completed / elapsed, 2),
+            "status_codes": dict(stats.statuses),
+            "latency": latency_summary(stats.latencies),
+            "latency_by_step": {step: latency_summary(ms) for step, ms in stats.by_step.items()},
+            "sends_per_conversation": {
+                "mean": round(statistics.fmean(sends), 1) if sends else 0,
+                "min": min(sends, default=0),
+                "max": max(sends, default=0),
+            },
+        }
+    finally:
+        if server is not None:
+            server.shutdown()
+        graph.stop()
+
+
+def print_report(report):
+    lat = report["latency"]
+    print(f"\nCompleted {report['completed']}/{report['conversations']} bookings in {report['elapsed_s']}s "
+          f"({report['bookings_per_s']} bookings/s, {report['throughput_rps']} webhook req/s)")
+    for reason, count in report["failed"].items():
+        print(f"  failed x{count}: {reason}")
+    print(f"Webhook latency: p50 {lat['p50_ms']} ms  p95 {lat['p95_ms']} ms  p99 {lat['p99_ms']} ms  "
+          f"max {lat['max_ms']} ms")
+    for step, s in report["latency_by_step"].items():
+        print(f"  {step:<15} n={s['count']:<6} p50 {s['p50_ms']:>9} ms  p95 {s['p95_ms']:>9} ms  "
+              f"p99 {s['p99_ms']:>9} ms")
+    sends = report["sends_per_conversation"]
+    print(f"Graph sends per conversation: mean {sends['mean']} (min {sends['min']}, max {sends['max']}); "
+          f"{report['graph']['failed_sends']} injected failures")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_load(args)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+            fh.write("\n")
+        print(f"Report written to {args.out}")
+    return 0 if report["completed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Check how many MongoDB commands each admin page and feed issues.
+
+    python -m bench.query_budget --seed-appointments 2000
+
+Every route in ROUTE_BUDGETS declares how many commands one request may
+issue with the output cache cold ("miss") and, for cached routes, when the
+same request is repeated ("hit", normally just the version counter read).
+Requests go through Flask's test client as a logged-in admin; getMore and
+killCursors are not counted, so a page that reads one long cursor costs one
+command whatever the data size, while a query per row shows up at once.
+Exits with status 1 when a route goes over its budget. CI runs it on every
+push against a throwaway MongoDB service (.github/workflows/query-budget.yml).
+"""
+import argparse
+import contextlib
+import io
+import sys
+from collections import Counter
+from datetime import date, timedelta
+
+from pymongo import monitoring
+
+from bench.replay import CommandCounter
+
+# Cursor continuation, not a separate query
+UNCOUNTED_COMMANDS = {"getMore", "killCursors", "endSessions"}
+
+# route -> (commands on a cache miss, commands on a cache hit or None if the route is not cached)
+ROUTE_BUDGETS = {
+    "dashboard": (6, 1),
+    "appointments": (2, 1),
+    "payments": (2, 1),
+    "reports": (3, 1),
+    "patient_history": (3, 1),
+    "inbox": (2, None),
+    "get_services": (2, 1),
+    "calendar_events": (3, 1),
+    "blocked_slots": (3, 1),
+    "free_times": (6, 1),
+    "earliest_slots": (6, None),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed-appointments", type=int, default=0,
+                        help="Reseed the bench database with this many appointments first (0 keeps it).")
+    parser.add_argument("--only", nargs="+", default=None, help="Only check these routes.")
+    parser.add_argument("--db", default="jaylon_clinic_bench")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    return parser.parse_args(argv)
+
+
+def route_paths(clinic):
+    """route -> request path, with ids and dates taken from the seeded data."""
+    in_3_days = (date.today() + timedelta(days=3)).isoformat()
+    window = f"?start={(date.today() - timedelta(days=7)).isoformat()}&end={(date.today() + timedelta(days=35)).isoformat()}"
+    service = clinic.services_collection.find_one({}, {"_id": 1})
+    service_query = f"?service_id={service['_id']}" if service else ""
+
+    return {
+        "dashboard": "/dashboard",
+        "appointments": "/appointments",
+        "payments": "/payments",
+        "reports": "/reports",
+        "patient_history": "/patient-history",
+        "inbox": "/inbox",
+        "get_services": "/get-services",
+        "calendar_events": "/api/calendar-events",
+        "blocked_slots": f"/api/blocked-slots{window}",
+        "free_times": f"/api/free-times/{in_3_days}{service_query}",
+        "earliest_slots": f"/api/earliest-slots{service_query}",
+    }
+
+
+def reset_caches(clinic):
+    """Empty every in-process cache so the next request pays for its own reads."""
+    with clinic._page_cache_guard:
+        clinic._page_cache.clear()
+    clinic.invalidate_block_cache()
+    clinic.invalidate_schedule_cache()
+
+
+def measure(client, counter, path):
+    counter.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        status = client.get(path).status_code
+    commands = Counter({
+        name: n for name, n in counter.stop().items() if name not in UNCOUNTED_COMMANDS
+    })
+    return status, commands
+
+
+def check_route(clinic, client, counter, name, path):
+    miss_budget, hit_budget = ROUTE_BUDGETS[name]
+    reset_caches(clinic)
+    status, miss = measure(client, counter, path)
+    result = {"route": name, "path": path, "status": status,
+              "miss": sum(miss.values()), "miss_budget": miss_budget, "miss_commands": dict(miss)}
+    ok = status == 200 and result["miss"] <= miss_budget
+
+    if hit_budget is not None:
+        _, hit = measure(client, counter, path)
+        result.update(hit=sum(hit.values()), hit_budget=hit_budget, hit_commands=dict(hit))
+        ok = ok and result["hit"] <= hit_budget
+
+    result["ok"] = ok
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    counter = CommandCounter()
+    # Listeners only apply to clients created after registration
+    monitoring.register(counter)
+    from bench.datagen import seed_database
+    from bench.run import load_app
+
+    clinic = load_app(args.db, args.mongo_uri)
+    if args.seed_appointments:
+        print(f"Seeding {args.seed_appointments:,} appointments into {args.db}...")
+        seed_database(clinic.db, args.seed_appointments)
+        with contextlib.redirect_stdout(io.StringIO()):
+            clinic.ensure_indexes()
+
+    admin = clinic.users_collection.find_one_and_update(
+        {"email": "bench-admin@example.com"},
+        {"$set": {"role": "admin", "fullname": "Bench Admin"}},
+        upsert=True, return_document=clinic.ReturnDocument.AFTER
+    )
+    client = clinic.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = str(admin["_id"])
+        session["role"] = "admin"
+
+    failures = 0
+    for name, path in route_paths(clinic).items():
+        if args.only and name not in args.only:
+            continue
+        r = check_route(clinic, client, counter, name, path)
+        hit = f"hit {r['hit']}/{r['hit_budget']}" if "hit" in r else "not cached"
+        print(f"{'ok  ' if r['ok'] else 'FAIL'} {name:<17} miss {r['miss']}/{r['miss_budget']}  {hit}  "
+              f"(HTTP {r['status']})")
+        if not r["ok"]:
+            failures += 1
+            print(f"     miss: {r['miss_commands']}")
+            if "hit" in r:
+                print(f"     hit:  {r['hit_commands']}")
+
+    if failures:
+        print(f"\n{failures} route(s) over their query budget")
+        return 1
+    print("\nAll routes within their query budgets")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Replay recorded webhook traffic (see webhook_log.py) against a test instance.
+
+    python -m bench.replay logs/webhook-*.jsonl.gz --speed 10 --out after.json
+    python -m bench.replay --compare before.json after.json
+
+Requests keep their original spacing divided by --speed (0 sends them as
+fast as the worker pool allows), so production bursts arrive as bursts.
+By default the app runs in-process against the benchmark database through
+Flask's test client, which also lets the replay count the MongoDB commands
+each webhook request issues. With --target the requests go over HTTP to a
+running instance and only latency is measured.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import monitoring
+
+from bench.datagen import sender_id
+from bench.fake_graph import FakeGraphServer
+from bench.loadgen import latency_summary
+from webhook_log import REDACTED_URL, read_webhook_log
+
+# Sender ids for replayed conversations, above the load generator's
+REPLAY_SENDER_BASE = 3 * 10 ** 9
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", help="Recorded webhook-*.jsonl.gz files.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = original timing, 10 = ten times faster, 0 = no waiting.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight at most.")
+    parser.add_argument("--target", default=None, help="Base URL of a running app (default: in-process).")
+    parser.add_argument("--graph-latency", type=float, default=0, help="Graph API send latency (ms).")
+    parser.add_argument("--seed-appointments", type=int, default=0,
+                        help="In-process mode: reseed the bench database with this many appointments first.")
+    parser.add_argument("--db", default="jaylon_clinic_bench")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--out", default=None, help="Write the report as JSON here.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two replay reports instead of replaying.")
+    return parser.parse_args(argv)
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Counts MongoDB commands per thread; sync pymongo reports them on the
+    calling thread, so background work (proof downloads, notifications) is
+    not attributed to the request that queued it.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.commands = Counter()
+
+    def stop(self):
+        commands = getattr(self._local, "commands", None) or Counter()
+        self._local.commands = None
+        return commands
+
+    def started(self, event):
+        commands = getattr(self._local, "commands", None)
+        if commands is not None:
+            commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def rewrite_body(body, senders, graph):
+    """Give pseudonymous senders fresh ids and point redacted attachments at the stand-in."""
+    for entry in body.get("entry", []):
+        for event in entry.get("messaging", []):
+            original = event["sender"]["id"]
+            if original not in senders:
+                senders[original] = sender_id(REPLAY_SENDER_BASE + len(senders))
+            event["sender"]["id"] = senders[original]
+            for att in event.get("message", {}).get("attachments", []):
+                if att.get("payload", {}).get("url") == REDACTED_URL:
+                    att["payload"]["url"] = graph.proof_url(senders[original])
+    return body
+
+
+class Replayer:
+    def __init__(self, args, graph):
+        self.args = args
+        self.graph = graph
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.recorded_ms = []
+        self.statuses = Counter()
+        self.commands_per_request = []
+        self.commands_by_name = Counter()
+        self.counter = None
+        self.http = None
+        self.app = None
+        self._clients = threading.local()
+
+        if args.target:
+            import requests
+            self.http = requests.Session()
+            self.target = args.target.rstrip("/")
+        else:
+            self.counter = CommandCounter()
+            # Listeners only apply to clients created after registration
+            monitoring.register(self.counter)
+            from bench.datagen import seed_database
+            from bench.run import load_app
+
+            clinic = load_app(args.db, args.mongo_uri)
+            if args.seed_appointments:
+                seed_database(clinic.db, args.seed_appointments)
+                clinic.ensure_indexes()
+            clinic.GRAPH_API_URL = graph.url
+            self.app = clinic.app
+
+    def send(self, record, body):
+        if self.counter:
+            self.counter.start()
+        start = time.perf_counter()
+        if self.http is not None:
+            status = self.http.post(f"{self.target}/webhook", json=body, timeout=60).status_code
+        else:
+            # One test client per worker thread; they keep cookie state
+            client = getattr(self._clients, "client", None)
+            if client is None:
+                client = self._clients.client = self.app.test_client()
+            status = client.post("/webhook", json=body).status_code
+        elapsed = (time.perf_counter() - start) * 1000
+        commands = self.counter.stop() if self.counter else None
+
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.recorded_ms.append(record.get("ms", 0))
+            self.statuses[status] += 1
+            if commands is not None:
+                self.commands_per_request.append(sum(commands.values()))
+                self.commands_by_name.update(commands)
+
+    def run(self, records):
+        senders = {}
+        first = records[0]["t"]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for record in records:
+                if self.args.speed > 0:
+                    due = (record["t"] - first) / self.args.speed
+                    delay = due - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                # Bodies are rewritten here, in arrival order, so sender ids are assigned consistently
+                body = rewrite_body(record["body"], senders, self.graph)
+                pool.submit(self.send, record, body)
+        elapsed = time.perf_counter() - start
+
+        report = {
+            "requests": len(records),
+            "senders": len(senders),
+            "speed": self.args.speed,
+            "recorded_span_s": round(records[-1]["t"] - first, 2),
+            "elapsed_s": round(elapsed, 2),
+            "throughput_rps": round(len(records) / elapsed, 1) if elapsed else None,
+            "status_codes": {str(k): v for k, v in self.statuses.items()},
+            "latency": latency_summary(self.latencies),
+            "recorded_latency": latency_summary(self.recorded_ms),
+            "graph_sends": self.graph.total_sends(),
+        }
+        if self.counter:
+            per_request = sorted(self.commands_per_request)
+            report["mongo_commands"] = {
+                "total": sum(per_request),
+                "per_request_mean": round(sum(per_request) / len(per_request), 2) if per_request else 0,
+                "per_request_max": per_request[-1] if per_request else 0,
+                "by_command": dict(self.commands_by_name.most_common()),
+            }
+        return report
+
+
+def print_report(report):
+    lat = report["latency"]
+    print(f"Replayed {report['requests']} requests from {report['senders']} senders in {report['elapsed_s']}s "
+          f"(recorded over {report['recorded_span_s']}s, speed {report['speed']}x)")
+    print(f"Status codes: {report['status_codes']}")
+    print(f"Latency:  p50 {lat['p50_ms']} ms  p95 {lat['p95_ms']} ms  p99 {lat['p99_ms']} ms  max {lat['max_ms']} ms")
+    rec = report["recorded_latency"]
+    print(f"Recorded: p50 {rec['p50_ms']} ms  p95 {rec['p95_ms']} ms  p99 {rec['p99_ms']} ms")
+    if "mongo_commands" in report:
+        mongo = report["mongo_commands"]
+        print(f"Mongo commands: {mongo['total']} total, {mongo['per_request_mean']} per request "
+              f"(max {mongo['per_request_max']}): {mongo['by_command']}")
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding="utf-8") as fh:
+        before = json.load(fh)
+    with open(after_path, encoding="utf-8") as fh:
+        after = json.load(fh)
+
+    def row(label, old, new):
+        if old is None or new is None:
+            return
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {label:<28} {old:>12} -> {new:<12} {change}")
+
+    print(f"{before_path} -> {after_path}")
+    for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms", "mean_ms"):
+        row(f"latency {key}", before["latency"].get(key), after["latency"].get(key))
+    row("throughput_rps", before.get("throughput_rps"), after.get("throughput_rps"))
+    if "mongo_commands" in before and "mongo_commands" in after:
+        row("mongo commands / request", before["mongo_commands"]["per_request_mean"],
+            after["mongo_commands"]["per_request_mean"])
+        names = set(before["mongo_commands"]["by_command"]) | set(after["mongo_commands"]["by_command"])
+        for name in sorted(names):
+            row(f"  {name}", before["mongo_commands"]["by_command"].get(name, 0),
+                after["mongo_commands"]["by_command"].get(name, 0))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    if not args.logs:
+        raise SystemExit("Give one or more recorded webhook logs, or --compare BEFORE AFTER")
+
+    records = read_webhook_log(args.logs)
+    if not records:
+        raise SystemExit("The logs contain no requests")
+
+    with FakeGraphServer(latency_ms=args.graph_latency) as graph:
+        report = Replayer(args, graph).run(records)
+    print_report(report)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+            fh.write("\n")
+        print(f"Report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Time the clinic's hot paths against synthetic data at several scales.
+
+    python -m bench.run --scales 1000 100000 --repeat 5 --out bench-results.json
+
+Views are timed below the output cache (their own code, as a logged-in
+admin), so the numbers show what a cache miss costs. Results are written as
+JSON so runs before and after a change can be compared.
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from bench.datagen import seed_database, sender_id
+from bench.fake_graph import FakeGraphServer
+
+DEFAULT_SCALES = [1000, 100000, 1000000]
+DEFAULT_DB_NAME = "jaylon_clinic_bench"
+
+# Sender ids for bot bookings, far above the seeded Messenger users
+BOT_SENDER_BASE = 10 ** 9
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="Appointment counts to seed and time (default: 1k, 100k, 1M).")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark.")
+    parser.add_argument("--years", type=int, default=3, help="Years of appointment history.")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run benchmarks with these names.")
+    parser.add_argument("--db", default=os.getenv("BENCH_DB_NAME", DEFAULT_DB_NAME),
+                        help="Database to seed. Its collections are dropped; the name must contain 'bench'.")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--out", default=None, help="Write JSON results here (default: stdout only).")
+    return parser.parse_args(argv)
+
+
+def load_app(db_name, mongo_uri):
+    """Import the app against the benchmark database."""
+    if "bench" not in db_name:
+        raise SystemExit(f"Refusing to seed '{db_name}': benchmark databases must have 'bench' in their name")
+
+    os.environ["DB_NAME"] = db_name
+    os.environ["MONGO_URI"] = mongo_uri
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as clinic
+
+    # app.py loads .env with override=True, which wins over the variables above
+    if clinic.db.name != db_name:
+        raise SystemExit(
+            f"The app connected to '{clinic.db.name}' instead of '{db_name}'. "
+            "Remove DB_NAME/MONGO_URI from .env before running benchmarks."
+        )
+    return clinic
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(p95, 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+    }
+
+
+def time_call(fn, repeat, warmup=1):
+    """Run fn warmup + repeat times (app prints suppressed) and summarize the timed runs."""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def view_call(clinic, admin_id, view, path, **kwargs):
+    """A callable that renders `view` for `path` as a logged-in admin, skipping the output cache."""
+    raw = inspect.unwrap(view)
+
+    def run():
+        with clinic.app.test_request_context(path):
+            clinic.session["user_id"] = admin_id
+            clinic.app.make_response(raw(**kwargs)).get_data()
+    return run
+
+
+class BotBooking:
+    """Walk one sender through the whole booking conversation per call."""
+
+    def __init__(self, clinic, graph, service):
+        self.clinic = clinic
+        self.graph = graph
+        self.service_id = str(service["_id"])
+        self.count = 0
+        self.senders = []
+
+    def __call__(self):
+        clinic = self.clinic
+        sender = sender_id(BOT_SENDER_BASE + self.count)
+        self.count += 1
+        self.senders.append(sender)
+
+        # What the BOOK_APPT postback does before handing over to handle_user_message
+        clinic.user_state[sender] = {"step": "choose_service", "service_id": None, "service_name": None,
+                                     "date": None, "time": None, "payment_method": None}
+        clinic.handle_user_message(sender, f"SERVICE_{self.service_id}")
+
+        day = date.today() + timedelta(days=7 + self.count % 21)
+        for _ in range(30):
+            clinic.handle_user_message(sender, day.strftime("%Y-%m-%d"))
+            if clinic.user_state[sender]["step"] == "choose_time":
+                break
+            day += timedelta(days=1)
+        times = [reply["title"] for reply in self.graph.last_quick_replies(sender)]
+
+        clinic.handle_user_message(sender, times[self.count % len(times)])
+        clinic.handle_user_message(sender, "bench patient")
+        clinic.handle_user_message(sender, "DP_YES")
+        clinic.handle_user_message(sender, "PAYMENT_GCASH")
+        clinic.handle_user_message(sender, self.graph.proof_url(sender))
+
+        if clinic.user_state[sender]["step"] != "waiting_admin":
+            raise RuntimeError(f"Bot booking stopped at step {clinic.user_state[sender]['step']!r}")
+
+    def cleanup(self):
+        self.clinic.appointments_collection.delete_many({"user_id": {"$in": self.senders}})
+        for sender in self.senders:
+            self.clinic.user_state.pop(sender, None)
+
+
+def benchmarks(clinic, graph, admin_id):
+    """name -> callable for every timed path."""
+    today = date.today()
+    in_3_days = (today + timedelta(days=3)).strftime("%Y-%m-%d")
+    month_ago = (today - timedelta(days=30)).strftime("%Y-%m-%d")
+    today_str = today.strftime("%Y-%m-%d")
+    window = (f"?start={(today - timedelta(days=7)).isoformat()}"
+              f"&end={(today + timedelta(days=35)).isoformat()}")
+    service = clinic.services_collection.find_one({"duration": 60})
+
+    return {
+        "free_times": lambda: clinic.get_free_times_for_date(in_3_days, 60),
+        "earliest_slots": lambda: clinic.find_earliest_slots(60),
+        "dashboard": view_call(clinic, admin_id, clinic.dashboard, "/dashboard"),
+        "appointments": view_call(clinic, admin_id, clinic.appointments, "/appointments"),
+        "payments": view_call(clinic, admin_id, clinic.payments, "/payments"),
+        "reports": view_call(clinic, admin_id, clinic.reports, "/reports"),
+        "reports_last_30_days": view_call(clinic, admin_id, clinic.reports,
+                                          f"/reports?from={month_ago}&to={today_str}"),
+        "patient_history": view_call(clinic, admin_id, clinic.patient_history, "/patient-history"),
+        "calendar_events": view_call(clinic, admin_id, clinic.calendar_events, "/api/calendar-events"),
+        "blocked_slots": view_call(clinic, admin_id, clinic.blocked_slots, f"/api/blocked-slots{window}"),
+        "bot_booking": BotBooking(clinic, graph, service),
+    }
+
+
+def run_scale(clinic, graph, scale, args):
+    print(f"\n== {scale:,} appointments")
+    start = time.perf_counter()
+    seeded = seed_database(clinic.db, scale, years=args.years)
+    seed_seconds = time.perf_counter() - start
+    print(f"   seeded in {seed_seconds:.1f}s: {seeded}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        clinic.ensure_indexes()
+    clinic.invalidate_schedule_cache()
+    clinic.invalidate_block_cache()
+
+    admin_id = str(clinic.users_collection.find_one_and_update(
+        {"email": "bench-admin@example.com"},
+        {"$set": {"role": "admin", "fullname": "Bench Admin"}},
+        upsert=True, return_document=clinic.ReturnDocument.AFTER
+    )["_id"])
+
+    timings = {}
+    for name, fn in benchmarks(clinic, graph, admin_id).items():
+        if args.only and name not in args.only:
+            continue
+        graph.reset()
+        timings[name] = time_call(fn, args.repeat)
+        if isinstance(fn, BotBooking):
+            timings[name]["graph_sends_per_booking"] = round(graph.total_sends() / (args.repeat + 1), 1)
+            fn.cleanup()
+        t = timings[name]
+        print(f"   {name:<22} median {t['median_ms']:>10.2f} ms   p95 {t['p95_ms']:>10.2f} ms")
+
+    return {"appointments": scale, "seeded": seeded, "seed_seconds": round(seed_seconds, 2), "timings": timings}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    clinic = load_app(args.db, args.mongo_uri)
+
+    results = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db": args.db,
+        "repeat": args.repeat,
+        "scales": []
+    }
+    with FakeGraphServer() as graph:
+        clinic.GRAPH_API_URL = graph.url
+        for scale in args.scales:
+            results["scales"].append(run_scale(clinic, graph, scale, args))
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+        print(f"\nResults written to {args.out}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Appointment lifecycle.
+
+Every status change goes through apply_transition(), which does a single
+find_one_and_update conditioned on the statuses the action may start from
+(and optionally the version the caller last saw). A stale or illegal change
+simply matches nothing, so concurrent admin and bot actions resolve the
+same way every time: the first one wins and the rest get a conflict.
+"""
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# Statuses an appointment can still be changed from
+ACTIVE_STATUSES = ["pending", "confirmed", "approved", "rescheduled"]
+
+# A booking can be rescheduled before its payment is reviewed, so payment
+# actions also start from "rescheduled"; PAYMENT_GUARD keeps them to
+# payments that are still waiting for review.
+PAYMENT_REVIEW_STATUSES = ["pending", "rescheduled"]
+PAYMENT_GUARD = {"payment_status": "pending"}
+
+# action -> (statuses it may start from, resulting status, timestamp field)
+TRANSITIONS = {
+    "approve_payment": (PAYMENT_REVIEW_STATUSES, "confirmed", "approved_at"),
+    "decline_payment": (PAYMENT_REVIEW_STATUSES, "declined", "declined_at"),
+    "reschedule": (ACTIVE_STATUSES, "rescheduled", "rescheduled_at"),
+    "cancel": (ACTIVE_STATUSES, "cancelled", "cancelled_at"),
+    "mark_done": (ACTIVE_STATUSES, "done", "completed_at"),
+}
+
+# Callables run as listener(action, appointment) after every applied transition
+_listeners = []
+
+
+def on_transition(listener):
+    """Register a listener for applied transitions. Usable as a decorator."""
+    _listeners.append(listener)
+    return listener
+
+
+def parse_version(value):
+    """
+    The version a client last saw, as sent in a form or JSON body; None when
+    it sent none. Raises ValueError for anything but a non-negative integer.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit():
+        raise ValueError("Invalid version, expected a non-negative integer")
+    return int(value)
+
+
+def transition_guard(action, expected_version=None):
+    """Filter (without _id) an appointment must match for the action to apply."""
+    from_statuses, _, _ = TRANSITIONS[action]
+    guard = {"status": {"$in": from_statuses}}
+    if action in ("approve_payment", "decline_payment"):
+        guard.update(PAYMENT_GUARD)
+    version = parse_version(expected_version)
+    if version is not None:
+        # Documents written before versioning count as version 0
+        guard["version"] = version if version else {"$in": [0, None]}
+    return guard
+
+
+def transition_update(action, fields=None, unset=None, now=None):
+    """Update document that moves an appointment through the action."""
+    _, to_status, timestamp_field = TRANSITIONS[action]
+    now = now or datetime.now()
+
+    update = {
+        "$set": {
+            **(fields or {}),
+            "status": to_status,
+            timestamp_field: now,
+            "updated_at": now
+        },
+        "$inc": {"version": 1}
+    }
+    if unset:
+        update["$unset"] = dict(unset)
+    return update
+
+
+def apply_transition(collection, action, appointment_id, fields=None, unset=None,
+                     expected_version=None, extra_filter=None, projection=None):
+    """
+    Apply a lifecycle action in one round trip.
+    Returns the updated appointment, or None if it does not exist or is not
+    in a state (or version) the action can start from.
+    """
+    if not ObjectId.is_valid(appointment_id):
+        return None
+    query = {
+        "_id": ObjectId(appointment_id),
+        **transition_guard(action, expected_version),
+        **(extra_filter or {})
+    }
+    appt = collection.find_one_and_update(
+        query,
+        transition_update(action, fields, unset),
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if appt is not None:
+        for listener in _listeners:
+            try:
+                listener(action, appt)
+            except Exception as e:
+                print(f"Transition listener {listener.__name__} failed: {e}")
+    return appt
+
+
+def describe_failure(collection, appointment_id, action):
+    """
+    Explain why apply_transition() matched nothing. Only called on the
+    failure path, so the happy path stays at one round trip.
+    Returns (error message, HTTP status code).
+    """
+    if not ObjectId.is_valid(appointment_id):
+        return "Appointment not found", 404
+    appt = collection.find_one({"_id": ObjectId(appointment_id)}, {"status": 1, "payment_status": 1})
+    if not appt:
+        return "Appointment not found", 404
+
+    from_statuses, _, _ = TRANSITIONS[action]
+    if appt.get("status") not in from_statuses:
+        return f"Appointment is already {appt.get('status')}", 409
+    if action in ("approve_payment", "decline_payment") and appt.get("payment_status") != "pending":
+        return f"Payment is already {appt.get('payment_status')}", 409
+
+    return "Appointment was changed by someone else. Please refresh and try again.", 409
@@ -0,0 +1,202 @@
+"""
+Memory instrumentation for long-running workers.
+
+A MemoryTracker keeps size gauges for registered in-process state (the
+Messenger user_state dict, the output and schedule caches, ...) and, when
+tracing is switched on, takes tracemalloc snapshots on a timer so the
+allocation sites that grew between two snapshots can be listed. Both are
+cheap to read: gauges copy a container under its lock and size the copy,
+and the diff compares snapshots that were already taken.
+"""
+import contextlib
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+# Allocations made by the tracer itself and the import machinery are noise
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def rss_bytes():
+    """Current resident set size, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def approx_size(obj):
+    """sys.getsizeof summed over obj and the containers and values it holds."""
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return size
+
+
+def _shallow_copy(obj):
+    if isinstance(obj, dict):
+        return dict(obj)
+    return list(obj)
+
+
+class MemoryTracker:
+    def __init__(self, interval=300, frames=1):
+        self.interval = interval
+        self.frames = frames
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        # (taken_at, snapshot): the first one after start, and the two most recent
+        self.baseline = None
+        self.previous = None
+        self.latest = None
+
+    def register(self, name, obj, lock=None):
+        """Report len() and approximate size of obj; lock is held while it is copied."""
+        self._gauges[name] = (obj, lock)
+
+    def gauges(self):
+        result = {}
+        for name, (obj, lock) in self._gauges.items():
+            with lock or contextlib.nullcontext():
+                copy = _shallow_copy(obj)
+            for _ in range(3):
+                try:
+                    size = approx_size(copy)
+                    break
+                except RuntimeError:
+                    # A nested dict changed size while it was walked; try again
+                    size = None
+            result[name] = {"entries": len(copy), "approx_bytes": size}
+        return result
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        """Start tracemalloc and the snapshot timer (once per process)."""
+        if self._thread is not None:
+            return self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.take_snapshot()
+        self._thread = threading.Thread(target=self._run, name="memory-snapshots", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.take_snapshot()
+            except Exception as e:
+                print("❌ Memory snapshot failed:", e)
+
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            return None
+        taken = (datetime.now(), tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS))
+        with self._lock:
+            if self.baseline is None:
+                self.baseline = taken
+            self.previous, self.latest = self.latest, taken
+        return taken
+
+    def top_growth(self, since="previous", limit=25):
+        """Allocation sites that grew the most between `since` (previous|baseline) and the latest snapshot."""
+        # Grouping by line keeps one frame per site; keep whole tracebacks when asked for them
+        key_type = "traceback" if self.frames > 1 else "lineno"
+        with self._lock:
+            older = self.baseline if since == "baseline" else self.previous
+            newer = self.latest
+        if older is None or newer is None or older is newer:
+            return None
+
+        stats = newer[1].compare_to(older[1], key_type)
+        return {
+            "from": older[0].isoformat(timespec="seconds"),
+            "to": newer[0].isoformat(timespec="seconds"),
+            "sites": [
+                {
+                    # Frames run oldest first; the allocating line is the last one
+                    "site": str(stat.traceback[-1]) if stat.traceback else "?",
+                    "traceback": [str(frame) for frame in stat.traceback] if self.frames > 1 else None,
+                    "size_bytes": stat.size,
+                    "size_diff_bytes": stat.size_diff,
+                    "count": stat.count,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[:limit]
+            ]
+        }
+
+    def report(self, since="previous", limit=25):
+        traced, peak = tracemalloc.get_traced_memory() if self.tracing else (None, None)
+        return {
+            "pid": os.getpid(),
+            "rss_bytes": rss_bytes(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "tracing": self.tracing,
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            "snapshot_interval_s": self.interval,
+            "gauges": self.gauges(),
+            "top_growth": self.top_growth(since, limit),
+        }
+
+    def metrics_text(self, prefix="clinic"):
+        """The gauges in Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{prefix}_{name}{labels} {value}")
+
+        pid = f'{{pid="{os.getpid()}"}}'
+        metric("process_rss_bytes", "Resident set size.", [(pid, rss_bytes())])
+        metric("process_peak_rss_bytes", "Peak resident set size.", [(pid, peak_rss_bytes())])
+        if self.tracing:
+            traced, peak = tracemalloc.get_traced_memory()
+            metric("tracemalloc_traced_bytes", "Memory currently traced by tracemalloc.", [(pid, traced)])
+            metric("tracemalloc_peak_bytes", "Peak memory traced by tracemalloc.", [(pid, peak)])
+
+        gauges = self.gauges()
+        metric("state_entries", "Entries in registered in-process state.",
+               [(f'{{pid="{os.getpid()}",name="{name}"}}', g["entries"]) for name, g in gauges.items()])
+        metric("state_approx_bytes", "Approximate size of registered in-process state.",
+               [(f'{{pid="{os.getpid()}",name="{name}"}}', g["approx_bytes"]) for name, g in gauges.items()])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,64 @@
+"""
+Stack-sampling profiler for single requests.
+
+A StackSampler runs a small thread that looks at the profiled thread's
+current stack every few milliseconds, so the request itself runs
+uninstrumented and the overhead stays proportional to the sampling rate.
+Stacks are counted in "collapsed" form (root;caller;callee -> count), which
+flamegraph.pl, speedscope and similar tools read directly.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Stop sampling a request that runs away (e.g. a stream) after this many samples
+MAX_SAMPLES = 20000
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse_stack(frame):
+    """'outer;...;inner' for a frame and its callers."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    def __init__(self, thread_id, interval_ms=5):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.elapsed_ms = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval) and self.samples < MAX_SAMPLES:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
@@ -0,0 +1,157 @@
+"""
+Interval-based availability.
+
+Times are handled as minutes since midnight. Each day's busy time
+(appointments and blocked slots) is merged into one sorted list of
+non-overlapping intervals, so checking whether a candidate slot is free is
+a single binary search instead of a scan over every booking.
+"""
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+# Clinic hours used until a schedule is configured: mornings and afternoons
+# with a lunch break, one start time every hour
+DEFAULT_OPENING_WINDOWS = [("09:00", "12:00"), ("13:00", "17:00")]
+DEFAULT_SLOT_STEP = 60
+DEFAULT_DAY_CONFIG = {
+    "open": "09:00",
+    "close": "17:00",
+    "breaks": [{"start": "12:00", "end": "13:00"}],
+    "slot_minutes": DEFAULT_SLOT_STEP,
+    "closed": False
+}
+
+# Used for bookings whose service has no duration on record
+DEFAULT_DURATION = 60
+
+
+def to_minutes(time_str):
+    """'HH:MM' -> minutes since midnight."""
+    hours, minutes = time_str.strip().split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def from_minutes(minutes):
+    """Minutes since midnight -> 'HH:MM'."""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class DayIntervals:
+    """Sorted, merged busy intervals [start, end) for one day."""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(i for i in intervals if i[1] > i[0]):
+            if self.ends and start <= self.ends[-1]:
+                # Overlaps or touches the previous interval: extend it
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def is_free(self, start, end):
+        """True if [start, end) does not overlap any busy interval."""
+        # The only interval that can overlap is the last one starting before `end`;
+        # merged intervals have increasing ends as well as starts
+        i = bisect_left(self.starts, end) - 1
+        return i < 0 or self.ends[i] <= start
+
+
+def compile_slot_starts(windows=DEFAULT_OPENING_WINDOWS, step=DEFAULT_SLOT_STEP):
+    """
+    Expand opening windows into (slot start, window end) pairs.
+    A booking starting at a slot must finish before its window closes.
+    """
+    slots = []
+    for open_time, close_time in windows:
+        window_start = to_minutes(open_time)
+        window_end = to_minutes(close_time)
+        for start in range(window_start, window_end, step):
+            slots.append((start, window_end))
+    return slots
+
+
+def free_slot_starts(slots, busy, duration=DEFAULT_DURATION):
+    """Slot start minutes where a booking of `duration` fits without conflicts."""
+    return [
+        start for start, window_end in slots
+        if start + duration <= window_end and busy.is_free(start, start + duration)
+    ]
+
+
+def opening_windows(open_time, close_time, breaks=()):
+    """Split opening hours around breaks into ('HH:MM', 'HH:MM') windows."""
+    windows = []
+    cursor = to_minutes(open_time)
+    close = to_minutes(close_time)
+    for br in sorted(breaks, key=lambda b: to_minutes(b["start"])):
+        br_start = max(to_minutes(br["start"]), cursor)
+        br_end = min(to_minutes(br["end"]), close)
+        if br_start >= br_end:
+            continue
+        if br_start > cursor:
+            windows.append((from_minutes(cursor), from_minutes(br_start)))
+        cursor = br_end
+    if cursor < close:
+        windows.append((from_minutes(cursor), from_minutes(close)))
+    return windows
+
+
+def compile_day_template(config):
+    """
+    Compile one schedule entry (weekly day or date exception) into the slot
+    list free_slot_starts() works on. A closed day compiles to no slots.
+    """
+    if not config or config.get("closed"):
+        return []
+    windows = opening_windows(config["open"], config["close"], config.get("breaks", []))
+    return compile_slot_starts(windows, int(config.get("slot_minutes") or DEFAULT_SLOT_STEP))
+
+
+def block_occurs_on(block, day):
+    """
+    True if a blocked-slot document applies to `day` (a date). One-off blocks
+    have a "date"; recurring ones carry a rule such as
+    {"freq": "weekly", "weekdays": [0, 2], "from": "2025-01-06", "until": None,
+     "except": ["2025-02-03"]}, or {"freq": "daily", ...} for a date range.
+    """
+    day_str = day.strftime("%Y-%m-%d")
+    rule = block.get("recurrence")
+    if not rule:
+        return block.get("date") == day_str
+
+    if day_str < rule["from"] or (rule.get("until") and day_str > rule["until"]):
+        return False
+    if day_str in rule.get("except", []):
+        return False
+    if rule["freq"] == "weekly":
+        weekdays = rule.get("weekdays")
+        if weekdays is None:
+            weekdays = [datetime.strptime(rule["from"], "%Y-%m-%d").weekday()]
+        return day.weekday() in weekdays
+    return rule["freq"] == "daily"
+
+
+def expand_blocks(blocks, first_day, last_day):
+    """
+    Expand one-off and recurring blocks into concrete occurrences between two
+    dates (inclusive): {'YYYY-MM-DD': [(start_minutes, end_minutes, block), ...]}
+    """
+    occurrences = {}
+    day = first_day
+    while day <= last_day:
+        day_str = day.strftime("%Y-%m-%d")
+        for block in blocks:
+            if block_occurs_on(block, day):
+                occurrences.setdefault(day_str, []).append(
+                    (to_minutes(block["start"]), to_minutes(block["end"]), block)
+                )
+        day += timedelta(days=1)
+    return occurrences
@@ -0,0 +1,39 @@
+// Live admin updates. With streaming enabled on the server (LIVE_STREAMING=1,
+// async or threaded workers) changes arrive over Server-Sent Events; otherwise
+// the page polls /api/changes with the last sequence number it has seen.
+// handlers: {change: fn(change), reset: fn()}
+var LIVE_CHANGES_POLL_MS = 15000;
+
+function subscribeChanges(kinds, handlers, streaming) {
+    var onChange = handlers.change || function() {};
+    var onReset = handlers.reset || function() {};
+
+    if (streaming && window.EventSource) {
+        var liveEvents = new EventSource('/api/events/stream?kinds=' + encodeURIComponent(kinds));
+        liveEvents.addEventListener('change', function(e) { onChange(JSON.parse(e.data)); });
+        liveEvents.addEventListener('reset', function() { onReset(); });
+        return;
+    }
+
+    var seq = null;
+    function poll() {
+        var qs = 'kinds=' + encodeURIComponent(kinds) + (seq === null ? '' : '&since=' + seq);
+        fetch('/api/changes?' + qs)
+            .then(function(res) { return res.json(); })
+            .then(function(data) {
+                if (!data.success) return;
+                // The first call only fetches the current sequence
+                if (seq !== null) {
+                    if (data.reset) {
+                        onReset();
+                    } else {
+                        data.changes.forEach(onChange);
+                    }
+                }
+                seq = data.seq;
+            })
+            .catch(function() {})
+            .then(function() { setTimeout(poll, LIVE_CHANGES_POLL_MS); });
+    }
+    poll();
+}
@@ -0,0 +1,115 @@
+"""
+Recorded Messenger webhook traffic.
+
+When recording is switched on (WEBHOOK_RECORD_DIR), every /webhook POST is
+stored as one JSON line {"t": arrival epoch seconds, "ms": handling time,
+"body": sanitized body} in gzip files, one per worker process. Senders are
+replaced by keyed pseudonyms (stable across workers), free text that is
+not a date, time or menu keyword is redacted and attachment URLs are
+dropped, so a log can be shared and replayed with bench/replay.py.
+"""
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+from datetime import datetime
+
+# Typed text the booking flow depends on; anything else may be personal
+KEPT_TEXT_RE = re.compile(
+    r"^\s*(\d{4}-\d{2}-\d{2}|\d{1,2}:\d{2}\s*[ap]m|menu|hi|hello|book|appointment|start|help)\s*$",
+    re.IGNORECASE
+)
+REDACTED_TEXT = "redacted"
+REDACTED_URL = "https://redacted.invalid/attachment"
+
+
+def pseudonym(sender_id, key):
+    """A 16-digit id standing in for a page-scoped sender id."""
+    digest = hmac.new(key.encode(), str(sender_id).encode(), hashlib.sha256).hexdigest()
+    return "9" + str(int(digest[:16], 16))[-15:].zfill(15)
+
+
+def _sanitize_message(message):
+    clean = {"mid": "m_redacted"}
+    if "quick_reply" in message:
+        # Payloads and titles come from the bot's own quick replies
+        clean["quick_reply"] = {"payload": message["quick_reply"].get("payload")}
+        clean["text"] = message.get("text", "")
+    elif "text" in message:
+        text = message["text"]
+        clean["text"] = text if KEPT_TEXT_RE.match(text) else REDACTED_TEXT
+    if "attachments" in message:
+        clean["attachments"] = [
+            {"type": att.get("type"), "payload": {"url": REDACTED_URL}}
+            for att in message["attachments"]
+        ]
+    return clean
+
+
+def sanitize_webhook_body(body, key):
+    """Copy of a webhook body that is safe to keep."""
+    entries = []
+    for entry in (body or {}).get("entry", []):
+        events = []
+        for event in entry.get("messaging", []):
+            clean = {
+                "sender": {"id": pseudonym(event.get("sender", {}).get("id"), key)},
+                "recipient": event.get("recipient"),
+                "timestamp": event.get("timestamp")
+            }
+            if "postback" in event:
+                clean["postback"] = {
+                    "title": event["postback"].get("title", ""),
+                    "payload": event["postback"].get("payload")
+                }
+            if "message" in event:
+                clean["message"] = _sanitize_message(event["message"])
+            events.append(clean)
+        entries.append({"id": entry.get("id"), "time": entry.get("time"), "messaging": events})
+    return {"object": (body or {}).get("object"), "entry": entries}
+
+
+class WebhookLogWriter:
+    """Appends records to this process's gzip log file. Used from one thread."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"webhook-{stamp}-{os.getpid()}.jsonl.gz")
+        self._fh = None
+
+    def write(self, record, flush=True):
+        if self._fh is None:
+            self._fh = gzip.open(self.path, "at", encoding="utf-8")
+            atexit.register(self.close)
+        self._fh.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+        if flush:
+            # A sync flush keeps everything written so far readable if the process dies
+            self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def read_webhook_log(paths):
+    """All records from one or more log files, ordered by arrival time."""
+    records = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            try:
+                for line in fh:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # The last line of a log whose process was killed mid-write
+                        continue
+            except EOFError:
+                # Log of a process that is still running (or was killed): no gzip trailer yet
+                pass
+    records.sort(key=lambda r: r["t"])
+    return records
@@ -0,0 +1,100 @@
+"""
+Write-behind buffering for records that do not need to be stored before a
+request returns (Messenger transcripts).
+
+Callers append to an in-memory list and return at once. A daemon thread
+hands the list to `flush` in batches, as soon as `max_items` are waiting
+or the oldest waiting record is `max_delay` seconds old, so the writes
+become a few insert_many calls instead of one round trip per record.
+Whatever is still buffered is flushed when the process exits normally.
+A crash loses everything still buffered: up to `max_pending` records while
+the database is unreachable, otherwise what arrived in the last
+`max_delay` seconds.
+"""
+import atexit
+import threading
+import time
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush, max_items=200, max_delay=1.0, max_pending=50000, name="write-behind"):
+        self.flush_fn = flush
+        self.max_items = max_items
+        self.max_delay = max_delay
+        # While the database is unreachable the oldest records are dropped past this
+        self.max_pending = max_pending
+        self.name = name
+        self.items = []
+        self.dropped = 0
+        self.flushed = 0
+        self.lock = threading.Lock()
+        self._wake = threading.Condition(self.lock)
+        self._oldest = None
+        self._thread = None
+
+    def add(self, item):
+        with self.lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if not self.items:
+                self._oldest = time.monotonic()
+            self.items.append(item)
+            if len(self.items) > self.max_pending:
+                del self.items[0]
+                self.dropped += 1
+            if len(self.items) >= self.max_items:
+                self._wake.notify()
+
+    def _take(self):
+        # In place: self.items is handed out for size reporting
+        batch = self.items[:self.max_items]
+        del self.items[:self.max_items]
+        self._oldest = time.monotonic() if self.items else None
+        return batch
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while True:
+                    if len(self.items) >= self.max_items:
+                        break
+                    if self.items:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._wake.wait(remaining)
+                    else:
+                        self._wake.wait()
+                batch = self._take()
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self.flush_fn(batch)
+            self.flushed += len(batch)
+        except Exception as e:
+            print(f"❌ {self.name}: could not store {len(batch)} records: {e}")
+            with self.lock:
+                # Retried with the next batch, unless the buffer is full by then
+                room = self.max_pending - len(self.items)
+                if room > 0:
+                    self.items[:0] = batch[-room:]
+                    self._oldest = time.monotonic()
+                self.dropped += max(len(batch) - max(room, 0), 0)
+            time.sleep(self.max_delay)
+
+    def flush(self):
+        """Write everything buffered now, on the calling thread."""
+        while True:
+            with self.lock:
+                batch = self._take()
+            if not batch:
+                return
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                print(f"❌ {self.name}: could not store {len(batch)} records: {e}")
+                return
+            self.flushed += len(batch)